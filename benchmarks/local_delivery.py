@@ -0,0 +1,70 @@
+'''
+Latency of a message from a client to another client of the same
+node, going through the broker and back, or delivered locally with
+`local_delivery=True`. Uses an in-memory broker by default, pass a
+Redis url to include a real round trip:
+
+    python benchmarks/local_delivery.py --url redis://localhost:6379/0
+'''
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any
+
+from distributed_websocket import Message, WebSocketManager
+
+
+class _Recipient:
+    '''
+    Stands for a connection, recording when frames are queued.
+    '''
+
+    def __init__(self, conn_id: str) -> None:
+        self.id = conn_id
+        self.topics = {'benchmark'}
+        self.queued = asyncio.Event()
+
+    def enqueue_frame(
+        self, frame: str, key: Any = None, conflate: bool = False
+    ) -> None:
+        self.queued.set()
+
+
+async def run(url: str, messages: int, local_delivery: bool) -> list[float]:
+    manager = WebSocketManager('benchmark', url, local_delivery=local_delivery)
+    await manager.startup()
+    recipient = _Recipient('recipient')
+    manager.active_connections.append(recipient)
+    manager._subscription_index.add_connection(recipient)
+    latencies = []
+    for i in range(messages):
+        recipient.queued.clear()
+        message = Message(data={'i': i}, typ='send', topic='benchmark')
+        start = time.perf_counter()
+        await manager.receive(None, message)
+        await recipient.queued.wait()
+        latencies.append(time.perf_counter() - start)
+    manager._subscription_index.remove_connection(recipient)
+    manager.active_connections.remove(recipient)
+    await manager.shutdown()
+    return latencies
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='memory://')
+    parser.add_argument('--messages', type=int, default=10_000)
+    args = parser.parse_args()
+    for local_delivery in (False, True):
+        latencies = await run(args.url, args.messages, local_delivery)
+        print(
+            f'local_delivery={local_delivery!s:<5} '
+            f'median {statistics.median(latencies) * 1e6:>8.1f} us  '
+            f'p99 {statistics.quantiles(latencies, n=100)[98] * 1e6:>8.1f} us'
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+'''
+Memory and time spent on a message on its way to the broker: the
+size of a `Message` against the same class without `__slots__`, and
+the bytes allocated while packing it into an envelope directly or
+after serializing it to a dict, as brokers did before:
+
+    python benchmarks/message_alloc.py --envelope binary
+'''
+
+import argparse
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from distributed_websocket import Message
+from distributed_websocket._envelope import pack_envelope
+from distributed_websocket.utils import serialize
+
+
+class _DictMessage:
+    '''
+    `Message` with its attributes in a `__dict__`.
+    '''
+
+    def __init__(self, *, data: Any, typ: str, topic=None, conn_id=None):
+        self.typ = typ
+        self.topic = topic
+        self.conn_id = conn_id
+        self.data = data
+        self.origin = None
+
+
+def instance_size(cls: type, messages: int) -> float:
+    payloads = [{'msg': i} for i in range(messages)]
+    tracemalloc.start()
+    kept = [cls(data=p, typ='send', topic='a/b') for p in payloads]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / messages
+
+
+def pack(
+    pack_message: Callable[[Message], bytes], messages: int
+) -> tuple[float, float]:
+    message = Message(
+        data={'msg': 'hello', 'values': list(range(10))},
+        typ='send',
+        topic='a/b',
+        origin='node1',
+    )
+    allocated = 0
+    tracemalloc.start()
+    for _ in range(messages):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        pack_message(message)
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(messages):
+        pack_message(message)
+    return allocated / messages, (time.perf_counter() - start) / messages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--envelope', default='json')
+    parser.add_argument('--messages', type=int, default=100_000)
+    args = parser.parse_args()
+    for cls in (_DictMessage, Message):
+        size = instance_size(cls, args.messages)
+        print(f'{cls.__name__:<12} {size:>8.1f} bytes per instance')
+    for name, pack_message in (
+        ('serialized', lambda m: pack_envelope(serialize(m), args.envelope)),
+        ('message', lambda m: pack_envelope(m, args.envelope)),
+    ):
+        allocated, elapsed = pack(pack_message, args.messages)
+        print(
+            f'{name:<12} {allocated:>8.1f} bytes allocated  '
+            f'{elapsed * 1e6:>6.2f} us per message'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''
+Publish throughput of `RedisBroker`, one round trip per message
+against pipelined batches. Needs a running redis-server:
+
+    python benchmarks/redis_publish.py --url redis://localhost:6379/0
+'''
+
+import argparse
+import asyncio
+import time
+
+from distributed_websocket._broker import RedisBroker
+
+
+async def run(url: str, messages: int, concurrency: int, **options) -> float:
+    broker = RedisBroker(url, **options)
+    payload = {'type': 'broadcast', 'topic': None, 'conn_id': None, 'x': 1}
+
+    async def publisher(count: int) -> None:
+        for _ in range(count):
+            await broker.publish('benchmark', dict(payload))
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(publisher(messages // concurrency) for _ in range(concurrency))
+    )
+    elapsed = time.perf_counter() - start
+    await broker.disconnect()
+    return messages / elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='redis://localhost:6379/0')
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+    for batch_size in (1, 10, 100, 1000):
+        rate = await run(
+            args.url,
+            args.messages,
+            args.concurrency,
+            publish_batch_size=batch_size,
+        )
+        print(f'publish_batch_size={batch_size:<5} {rate:>10.0f} msg/s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,10 +1,11 @@
 from ._auth import WebSocketOAuth2PasswordBearer
-from ._broker import (BrokerInterface, InMemoryBroker, RedisBroker,
-                      create_broker)
+from ._broker import (BrokerInterface, InMemoryBroker, InMemoryHub,
+                      RedisBroker, RedisStreamsBroker, create_broker)
+from ._codec import Codec, get_codec
 from ._connection import Connection
 from ._decorators import ahandle, handle
-from ._exceptions import (InvalidSubscription, InvalidSubscriptionMessage,
-                          WebSocketException)
+from ._exceptions import (InvalidConnectMessage, InvalidSubscription,
+                          InvalidSubscriptionMessage, WebSocketException)
 from ._matching import matches
 from ._message import Message
 from ._subscriptions import handle_subscription_message, subscribe, unsubscribe
@@ -20,15 +21,20 @@ __all__ = (
     'Connection',
     'BrokerInterface',
     'InMemoryBroker',
+    'InMemoryHub',
     'RedisBroker',
+    'RedisStreamsBroker',
     'create_broker',
     'BrokerT',
+    'Codec',
+    'get_codec',
     'Message',
     'handle',
     'ahandle',
     'WebSocketException',
     'InvalidSubscription',
     'InvalidSubscriptionMessage',
+    'InvalidConnectMessage',
     'matches',
     'subscribe',
     'unsubscribe',
@@ -1,18 +1,45 @@
-__all__ = ('BrokerInterface', 'create_broker')
+__all__ = (
+    'BrokerInterface',
+    'InMemoryHub',
+    'InMemoryBroker',
+    'RedisBroker',
+    'RedisStreamsBroker',
+    'create_broker',
+)
 
 import asyncio
-import json
+import logging
+import math
+import re
+import time
+import weakref
 from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Iterable
 from typing import Any
-from urllib.parse import urlparse
+from urllib.parse import parse_qsl, urlencode, urlparse
 
 from redis.asyncio import Redis
 from redis.asyncio.client import PubSub
+from redis.asyncio.connection import HIREDIS_AVAILABLE
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
 
-from ._message import Message, untag_broker_message
+from ._codec import Codec, get_codec
+from ._compression import validate_compression
+from ._envelope import pack_envelope, validate_envelope
+from ._message import Message
+
+logger = logging.getLogger(__name__)
 
 
 class BrokerInterface(ABC):
+    # the optional features a broker implements: `psubscribe` and
+    # `punsubscribe` for topic routing, and the conn_id registry
+    # methods for direct routing
+    supports_psubscribe: bool = False
+    supports_conn_id_registry: bool = False
+
     @abstractmethod
     async def connect(self) -> None:
         ...
@@ -33,15 +60,194 @@ class BrokerInterface(ABC):
     async def publish(self, channel: str, message: Any) -> None:
         ...
 
+    async def publish_many(self, messages: Iterable[tuple[str, Any]]) -> None:
+        '''
+        Publish `(channel, message)` pairs, in order. Brokers that
+        can send them at once override the default, that publishes
+        them one by one.
+        '''
+        for channel, message in messages:
+            await self.publish(channel, message)
+
+    async def psubscribe(self, pattern: str) -> None:
+        '''
+        Subscribe to the channels matching a Redis glob-style pattern.
+        Required by `WebSocketManager(..., broker_routing='topic')`.
+        '''
+        raise NotImplementedError
+
+    async def punsubscribe(self, pattern: str) -> None:
+        raise NotImplementedError
+
+    async def register_conn_ids(
+        self, conn_ids: Iterable[str], node_id: str, ttl: float
+    ) -> None:
+        '''
+        Record that `node_id` holds connections with these ids, for
+        `ttl` seconds unless registered again.
+        Required by `WebSocketManager(..., direct_routing=True)`,
+        as are `unregister_conn_ids` and `locate_conn_ids`.
+        '''
+        raise NotImplementedError
+
+    async def unregister_conn_ids(
+        self, conn_ids: Iterable[str], node_id: str
+    ) -> None:
+        raise NotImplementedError
+
+    async def locate_conn_ids(
+        self, conn_ids: Iterable[str]
+    ) -> dict[str, set[str]]:
+        '''
+        Return the ids of the nodes holding each of `conn_ids`.
+        '''
+        raise NotImplementedError
+
     @abstractmethod
     async def get_message(self, **kwargs) -> Message | None:
         ...
 
+    async def get_messages(
+        self, max_count: int = 100, **kwargs
+    ) -> list[Message]:
+        '''
+        Wait for a message like `get_message` (with the same keyword
+        arguments), and return it with up to `max_count - 1` more
+        messages already received. Brokers that can't tell whether
+        more messages are waiting return one message at most.
+        '''
+        message = await self.get_message(**kwargs)
+        return [] if message is None else [message]
+
+
+def _encode_message(broker: BrokerInterface, message: Any) -> Any:
+    # `Message` and serialized messages are packed with the envelope
+    # and the compression of the broker, the others are published as
+    # they are
+    if isinstance(message, (dict, Message)):
+        return pack_envelope(
+            message,
+            broker.envelope,
+            broker.codec,
+            broker.compression,
+            broker.compression_threshold,
+        )
+    return message
+
+
+def _glob_class_to_regex(body: str) -> str:
+    # `-` stays a range operator, other special characters are literal
+    negate = body.startswith('^')
+    if negate:
+        body = body[1:]
+    if not body:
+        return '(?!)'
+    body = ''.join(f'\\{c}' if c in '\\[]^' else c for c in body)
+    return f'[^{body}]' if negate else f'[{body}]'
+
+
+def _glob_to_regex(pattern: str) -> re.Pattern:
+    # Redis glob-style patterns: `*`, `?`, `[...]` and `\` escapes
+    regex, i = [], 0
+    while i < len(pattern):
+        char = pattern[i]
+        end = pattern.find(']', i + 1) if char == '[' else -1
+        if char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        elif char == '*':
+            regex.append('.*')
+        elif char == '?':
+            regex.append('.')
+        elif end != -1:
+            regex.append(_glob_class_to_regex(pattern[i + 1:end]))
+            i = end
+        else:
+            regex.append(re.escape(char))
+        i += 1
+    return re.compile(''.join(regex), re.DOTALL)
+
+
+class InMemoryHub:
+    '''
+    In process pub/sub: a published message is put in the queue of
+    every `InMemoryBroker` subscribed to its channel. Brokers sharing
+    a hub (e.g. the brokers of several `WebSocketManager`s, or of
+    test nodes) each receive their own copy, and share the conn_id
+    registry.
+    '''
 
-class InMemoryBroker(BrokerInterface):
     def __init__(self) -> None:
+        self._channels: dict[str, set['InMemoryBroker']] = {}
+        self._pattern_subscribers: set['InMemoryBroker'] = set()
+        # conn_id -> node_id -> expiration time
+        self._registry: dict[str, dict[str, float]] = {}
+
+    def _subscribe(self, broker: 'InMemoryBroker', channel: str) -> None:
+        self._channels.setdefault(channel, set()).add(broker)
+
+    def _unsubscribe(self, broker: 'InMemoryBroker', channel: str) -> None:
+        brokers = self._channels.get(channel)
+        if brokers is not None:
+            brokers.discard(broker)
+            if not brokers:
+                del self._channels[channel]
+
+    def _update_patterns(self, broker: 'InMemoryBroker') -> None:
+        if broker._patterns:
+            self._pattern_subscribers.add(broker)
+        else:
+            self._pattern_subscribers.discard(broker)
+
+    def publish(self, channel: str, message: Any) -> int:
+        '''
+        Deliver `message` to the subscribers of `channel`, returning
+        their number.
+        '''
+        brokers = set(self._channels.get(channel, ()))
+        for broker in self._pattern_subscribers:
+            if broker._match_pattern(channel):
+                brokers.add(broker)
+        for broker in brokers:
+            broker._put(channel, message)
+        return len(brokers)
+
+
+_hubs: 'weakref.WeakValueDictionary[str, InMemoryHub]' = (
+    weakref.WeakValueDictionary()
+)
+
+
+def _get_hub(name: str) -> InMemoryHub:
+    hub = _hubs.get(name)
+    if hub is None:
+        hub = _hubs[name] = InMemoryHub()
+    return hub
+
+
+class InMemoryBroker(BrokerInterface):
+    '''
+    Subscribes to an `InMemoryHub`, its own one unless `hub` is given.
+    Messages wait for `get_message` in a queue of `max_queue_size`
+    messages: when it is full the oldest one is dropped, and counted
+    in `dropped_messages`.
+    '''
+
+    supports_psubscribe = True
+    supports_conn_id_registry = True
+
+    def __init__(
+        self,
+        codec: Codec | str | None = None,
+        hub: InMemoryHub | None = None,
+        max_queue_size: int = 1024,
+    ) -> None:
+        self.hub: InMemoryHub = hub if hub is not None else InMemoryHub()
         self._subscribers: set = set()
-        self._messages: asyncio.Queue = asyncio.Queue()
+        self._patterns: dict[str, re.Pattern] = {}
+        self._messages: asyncio.Queue = asyncio.Queue(max_queue_size)
+        self.dropped_messages: int = 0
+        self.codec: Codec = get_codec(codec)
 
     async def __aenter__(self) -> BrokerInterface:
         return self
@@ -53,34 +259,202 @@ class InMemoryBroker(BrokerInterface):
         pass
 
     async def disconnect(self) -> None:
-        pass
+        for channel in self._subscribers:
+            self.hub._unsubscribe(self, channel)
+        self._subscribers.clear()
+        self._patterns.clear()
+        self.hub._update_patterns(self)
 
     async def subscribe(self, channel: str) -> None:
         self._subscribers.add(channel)
+        self.hub._subscribe(self, channel)
 
     async def unsubscribe(self, channel: str) -> None:
         self._subscribers.remove(channel)
+        self.hub._unsubscribe(self, channel)
+
+    async def psubscribe(self, pattern: str) -> None:
+        self._patterns[pattern] = _glob_to_regex(pattern)
+        self.hub._update_patterns(self)
+
+    async def punsubscribe(self, pattern: str) -> None:
+        del self._patterns[pattern]
+        self.hub._update_patterns(self)
 
     async def publish(self, channel: str, message: Any) -> None:
-        await self._messages.put({'channel': channel, 'data': message})
+        self.hub.publish(channel, message)
+
+    def _put(self, channel: str, message: Any) -> None:
+        if self._messages.full():
+            self._messages.get_nowait()
+            self.dropped_messages += 1
+        self._messages.put_nowait({'channel': channel, 'data': message})
+
+    async def register_conn_ids(
+        self, conn_ids: Iterable[str], node_id: str, ttl: float
+    ) -> None:
+        expires = time.time() + ttl
+        for conn_id in conn_ids:
+            self.hub._registry.setdefault(conn_id, {})[node_id] = expires
+
+    async def unregister_conn_ids(
+        self, conn_ids: Iterable[str], node_id: str
+    ) -> None:
+        for conn_id in conn_ids:
+            nodes = self.hub._registry.get(conn_id)
+            if nodes is not None:
+                nodes.pop(node_id, None)
+                if not nodes:
+                    del self.hub._registry[conn_id]
+
+    async def locate_conn_ids(
+        self, conn_ids: Iterable[str]
+    ) -> dict[str, set[str]]:
+        now = time.time()
+        registry = self.hub._registry
+        return {
+            conn_id: {
+                node_id
+                for node_id, expires in registry.get(conn_id, {}).items()
+                if expires > now
+            }
+            for conn_id in conn_ids
+        }
+
+    def _to_message(self, message: dict) -> Message:
+        data = message['data']
+        if isinstance(data, Message):
+            # shared by every subscriber, its payload is never modified
+            return data
+        if isinstance(data, dict):
+            # untagging pops the envelope keys of the dict
+            data = dict(data)
+        return Message.from_broker_message(data, self.codec)
 
     async def get_message(self, **kwargs) -> Message | None:
-        message = await self._messages.get()
-        if self.has_subscribers(message['channel']):
-            typ, topic, conn_id, data = untag_broker_message(message['data'])
-            return Message(data=data, typ=typ, topic=topic, conn_id=conn_id)
+        return self._to_message(await self._messages.get())
+
+    async def get_messages(
+        self, max_count: int = 100, **kwargs
+    ) -> list[Message]:
+        messages = [await self._messages.get()]
+        while len(messages) < max_count and not self._messages.empty():
+            messages.append(self._messages.get_nowait())
+        return [self._to_message(message) for message in messages]
+
+    def _match_pattern(self, channel: str) -> bool:
+        return any(
+            regex.fullmatch(channel) for regex in self._patterns.values()
+        )
 
     def has_subscribers(self, channel: str) -> bool:
-        return channel in self._subscribers
+        return channel in self._subscribers or self._match_pattern(channel)
+
+
+def _decode(value: bytes | str) -> str:
+    # bytes unless the client was created with `decode_responses=True`
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _get_parser_class(parser: str) -> type:
+    # redis>=5 moved the parsers to `redis._parsers`, older versions
+    # define them in `redis.asyncio.connection`
+    if parser not in ('python', 'hiredis'):
+        raise ValueError(f'Unknown parser: {parser}')
+    if parser == 'hiredis' and not HIREDIS_AVAILABLE:
+        raise ImportError('hiredis parser requires hiredis to be installed')
+    try:
+        from redis._parsers import _AsyncHiredisParser, _AsyncRESP2Parser
+    except ImportError:
+        from redis.asyncio.connection import HiredisParser, PythonParser
+    else:
+        HiredisParser, PythonParser = _AsyncHiredisParser, _AsyncRESP2Parser
+    return PythonParser if parser == 'python' else HiredisParser
 
 
 class RedisBroker(BrokerInterface):
+    '''
+    `get_message` blocks on the pubsub socket for up to
+    `get_message_timeout` seconds (forever if `None`), so an idle
+    listener does not spin while a message is returned as soon as
+    it arrives.
+
+    `publish` collects messages into a pipeline, sent once it holds
+    `publish_batch_size` messages or `publish_max_delay` seconds
+    after the first one. Each call still waits for its own message
+    to be published and raises its own error. A batch size of 1
+    publishes every message on its own.
+
+    The nodes holding each conn_id are kept in a hash per conn_id,
+    `<registry_key>:<conn_id>`, mapping node ids to the time their
+    entry expires. Every registration pushes back the expiration of
+    the key, so that it goes away once no node refreshes it.
+
+    Publishing and subscribing use separate connection pools unless
+    `separate_subscriber_pool` is `False`, so that publish bursts do
+    not compete with the listener. `max_connections`,
+    `socket_keepalive`, `health_check_interval`, `parser` (`hiredis`
+    or `python`) and any other keyword argument configure both.
+
+    Envelopes of at least `compression_threshold` bytes are
+    compressed with `compression` (`zlib`, or `zstd` if zstandard
+    is installed), if set.
+    '''
+
+    supports_psubscribe = True
+    supports_conn_id_registry = True
+
     def __init__(
         self,
         redis_url: str,
+        codec: Codec | str | None = None,
+        envelope: str = 'json',
+        get_message_timeout: float | None = 1.0,
+        publish_batch_size: int = 100,
+        publish_max_delay: float = 0.001,
+        registry_key: str = 'distributed_websocket:conn_id',
+        max_connections: int | None = None,
+        socket_keepalive: bool | None = None,
+        health_check_interval: float | None = None,
+        parser: str | None = None,
+        separate_subscriber_pool: bool = True,
+        compression: str | None = None,
+        compression_threshold: int = 1024,
+        **redis_options,
     ) -> None:
-        self._redis: Redis = Redis.from_url(redis_url)
-        self._pubsub: PubSub = self._redis.pubsub()
+        validate_envelope(envelope)
+        validate_compression(compression)
+        if publish_batch_size < 1:
+            raise ValueError('publish_batch_size must be at least 1')
+        for name, value in (
+            ('max_connections', max_connections),
+            ('socket_keepalive', socket_keepalive),
+            ('health_check_interval', health_check_interval),
+        ):
+            if value is not None:
+                redis_options[name] = value
+        if parser is not None:
+            redis_options['parser_class'] = _get_parser_class(parser)
+        self._redis: Redis = Redis.from_url(redis_url, **redis_options)
+        self._subscriber: Redis = (
+            Redis.from_url(redis_url, **redis_options)
+            if separate_subscriber_pool
+            else self._redis
+        )
+        self._pubsub: PubSub = self._subscriber.pubsub()
+        self.codec: Codec = get_codec(codec)
+        self.envelope: str = envelope
+        self.compression: str | None = compression
+        self.compression_threshold: int = compression_threshold
+        self.get_message_timeout: float | None = get_message_timeout
+        self.publish_batch_size: int = publish_batch_size
+        self.publish_max_delay: float = publish_max_delay
+        self.registry_key: str = registry_key
+        self._pending: list[tuple[str, Any, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        # batches are sent one at a time, in order
+        self._flush_lock: asyncio.Lock = asyncio.Lock()
 
     async def __aenter__(self) -> BrokerInterface:
         return self
@@ -92,8 +466,11 @@ class RedisBroker(BrokerInterface):
         pass
 
     async def disconnect(self) -> None:
+        await self.flush()
         await self._pubsub.reset()
         await self._redis.close()
+        if self._subscriber is not self._redis:
+            await self._subscriber.close()
 
     async def subscribe(self, channel: str) -> None:
         await self._pubsub.subscribe(channel)
@@ -101,34 +478,392 @@ class RedisBroker(BrokerInterface):
     async def unsubscribe(self, channel: str) -> None:
         await self._pubsub.unsubscribe(channel)
 
+    async def psubscribe(self, pattern: str) -> None:
+        await self._pubsub.psubscribe(pattern)
+
+    async def punsubscribe(self, pattern: str) -> None:
+        await self._pubsub.punsubscribe(pattern)
+
     async def publish(self, channel: str, message: Any) -> None:
-        if isinstance(message, dict):
-            message = json.dumps(message)
-        await self._redis.publish(channel, message)
+        message = _encode_message(self, message)
+        if self.publish_batch_size == 1:
+            await self._publish_command(self._redis, channel, message)
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((channel, message, future))
+        if len(self._pending) >= self.publish_batch_size:
+            self._schedule_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(
+                self.publish_max_delay, self._schedule_flush
+            )
+        await future
+
+    async def publish_many(self, messages: Iterable[tuple[str, Any]]) -> None:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for channel, message in messages:
+            message = _encode_message(self, message)
+            future = loop.create_future()
+            self._pending.append((channel, message, future))
+            futures.append(future)
+        # in a single pipeline, with the messages already pending
+        self._schedule_flush()
+        await asyncio.gather(*futures)
+
+    def _publish_command(self, client: Any, channel: str, message: Any) -> Any:
+        # `client` is either the Redis client or a pipeline
+        return client.publish(channel, message)
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, batch: list) -> None:
+        async with self._flush_lock:
+            pipeline = self._redis.pipeline(transaction=False)
+            for channel, message, _ in batch:
+                self._publish_command(pipeline, channel, message)
+            try:
+                results = await pipeline.execute(raise_on_error=False)
+            except Exception as exc:
+                results = [exc] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def flush(self) -> None:
+        '''
+        Send the pending messages and wait for all batches to be sent.
+        '''
+        self._schedule_flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    def _registry_key(self, conn_id: str) -> str:
+        return f'{self.registry_key}:{conn_id}'
+
+    async def register_conn_ids(
+        self, conn_ids: Iterable[str], node_id: str, ttl: float
+    ) -> None:
+        expires = time.time() + ttl
+        pipeline = self._redis.pipeline(transaction=False)
+        for conn_id in conn_ids:
+            key = self._registry_key(conn_id)
+            pipeline.hset(key, node_id, expires)
+            pipeline.expire(key, math.ceil(ttl))
+        await pipeline.execute()
+
+    async def unregister_conn_ids(
+        self, conn_ids: Iterable[str], node_id: str
+    ) -> None:
+        pipeline = self._redis.pipeline(transaction=False)
+        for conn_id in conn_ids:
+            pipeline.hdel(self._registry_key(conn_id), node_id)
+        await pipeline.execute()
+
+    async def locate_conn_ids(
+        self, conn_ids: Iterable[str]
+    ) -> dict[str, set[str]]:
+        conn_ids = list(conn_ids)
+        pipeline = self._redis.pipeline(transaction=False)
+        for conn_id in conn_ids:
+            pipeline.hgetall(self._registry_key(conn_id))
+        now = time.time()
+        return {
+            conn_id: {
+                _decode(node_id)
+                for node_id, expires in nodes.items()
+                if float(expires) > now
+            }
+            for conn_id, nodes in zip(conn_ids, await pipeline.execute())
+        }
 
     async def get_message(self, **kwargs) -> Message | None:
         message = await self._pubsub.get_message(
-            ignore_subscribe_messages=True
+            ignore_subscribe_messages=True,
+            timeout=kwargs.get('timeout', self.get_message_timeout),
         )
         if message:
-            typ, topic, conn_id, data = untag_broker_message(message['data'])
-            return Message(data=data, typ=typ, topic=topic, conn_id=conn_id)
+            return Message.from_broker_message(message['data'], self.codec)
+
+    async def get_messages(
+        self, max_count: int = 100, **kwargs
+    ) -> list[Message]:
+        messages = []
+        message = await self.get_message(**kwargs)
+        while message is not None:
+            messages.append(message)
+            if len(messages) == max_count:
+                break
+            # only what is already on the connection
+            message = await self.get_message(timeout=0)
+        return messages
+
+
+class RedisStreamsBroker(RedisBroker):
+    '''
+    A `RedisBroker` publishing to Redis streams (XADD) instead of
+    pub/sub channels, each stream trimmed to about `maxlen` entries.
+
+    The listener reads all the subscribed streams at once (XREAD),
+    up to `read_count` entries per stream, from the last ID it has
+    seen in each one: a node that is slow or reconnecting catches
+    up instead of losing messages, as long as they were not trimmed.
+    Streams are read from their last entry at subscription time,
+    or from `start_id` if given (e.g. `0` to replay them).
+    If a read fails on a connection error, the next one is delayed
+    by `retry_delay` seconds, doubling up to `max_retry_delay`, and
+    resumes from the same IDs.
+    Glob subscriptions are not supported.
+    '''
+
+    supports_psubscribe = False
+
+    def __init__(
+        self,
+        redis_url: str,
+        codec: Codec | str | None = None,
+        envelope: str = 'json',
+        maxlen: int | None = 10_000,
+        read_count: int = 100,
+        start_id: str | None = None,
+        retry_delay: float = 0.1,
+        max_retry_delay: float = 5.0,
+        **options,
+    ) -> None:
+        super().__init__(redis_url, codec, envelope, **options)
+        self.maxlen: int | None = maxlen
+        self.read_count: int = read_count
+        self.start_id: str | None = start_id
+        self.retry_delay: float = retry_delay
+        self.max_retry_delay: float = max_retry_delay
+        self.last_ids: dict[str, bytes | str] = {}
+        self._entries: deque = deque()
+        self._subscribed: asyncio.Event = asyncio.Event()
+        self._backoff: float = 0.0
+
+    async def subscribe(self, channel: str) -> None:
+        if channel in self.last_ids:
+            return
+        start_id = self.start_id
+        if start_id is None:
+            last = await self._subscriber.xrevrange(channel, count=1)
+            start_id = last[0][0] if last else '0-0'
+        self.last_ids[channel] = start_id
+        self._subscribed.set()
+
+    async def unsubscribe(self, channel: str) -> None:
+        self.last_ids.pop(channel, None)
+        if not self.last_ids:
+            self._subscribed.clear()
+
+    async def psubscribe(self, pattern: str) -> None:
+        raise NotImplementedError('Redis streams have no glob subscriptions')
 
+    async def punsubscribe(self, pattern: str) -> None:
+        raise NotImplementedError('Redis streams have no glob subscriptions')
 
-def _create_inmemory_broker() -> InMemoryBroker:
-    return InMemoryBroker()
+    def _publish_command(self, client: Any, channel: str, message: Any) -> Any:
+        return client.xadd(
+            channel, {'data': message}, maxlen=self.maxlen, approximate=True
+        )
+
+    async def _wait_subscribed(self, timeout: float | None) -> None:
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _read(self, timeout: float | None) -> None:
+        if not self.last_ids:
+            await self._wait_subscribed(timeout)
+            return
+        block = 0 if timeout is None else max(int(timeout * 1000), 1)
+        try:
+            response = await self._subscriber.xread(
+                self.last_ids, count=self.read_count, block=block
+            )
+        except (RedisConnectionError, RedisTimeoutError) as exc:
+            self._backoff = min(
+                max(self._backoff * 2, self.retry_delay), self.max_retry_delay
+            )
+            logger.warning(
+                'Failed to read the streams (%s), retrying in %.1fs',
+                exc,
+                self._backoff,
+            )
+            await asyncio.sleep(self._backoff)
+            return
+        self._backoff = 0.0
+        for stream, entries in response or ():
+            channel = stream.decode() if isinstance(stream, bytes) else stream
+            if channel not in self.last_ids:
+                # unsubscribed while reading
+                continue
+            self.last_ids[channel] = entries[-1][0]
+            self._entries.extend(fields[b'data'] for _, fields in entries)
+
+    def _to_message(self, entry: bytes) -> Message:
+        return Message.from_broker_message(entry, self.codec)
+
+    async def get_message(self, **kwargs) -> Message | None:
+        if not self._entries:
+            await self._read(kwargs.get('timeout', self.get_message_timeout))
+        if self._entries:
+            return self._to_message(self._entries.popleft())
+
+    async def get_messages(
+        self, max_count: int = 100, **kwargs
+    ) -> list[Message]:
+        if not self._entries:
+            await self._read(kwargs.get('timeout', self.get_message_timeout))
+        count = min(max_count, len(self._entries))
+        return [
+            self._to_message(self._entries.popleft()) for _ in range(count)
+        ]
+
+
+def _create_inmemory_broker(
+    codec: Codec | str | None = None,
+    hub: str | None = None,
+    max_queue_size: int = 1024,
+    **options,
+) -> InMemoryBroker:
+    # the options of the other brokers are ignored, so that a
+    # `memory://` url can stand in for any of them (e.g. in tests)
+    return InMemoryBroker(
+        codec, _get_hub(hub) if hub else None, max_queue_size
+    )
 
 
 def _create_redis_broker(
     redis_url: str,
+    codec: Codec | str | None = None,
+    envelope: str = 'json',
+    **options,
 ) -> RedisBroker:
-    return RedisBroker(redis_url)
+    return RedisBroker(redis_url, codec, envelope, **options)
+
+
+def _create_redis_streams_broker(
+    redis_url: str,
+    codec: Codec | str | None = None,
+    envelope: str = 'json',
+    **options,
+) -> RedisStreamsBroker:
+    return RedisStreamsBroker(redis_url, codec, envelope, **options)
+
+
+def _create_ipc_broker(
+    path: str,
+    codec: Codec | str | None = None,
+    envelope: str = 'json',
+    **options,
+) -> BrokerInterface:
+    # _ipc builds on this module
+    from ._ipc import IPCBroker
+
+    return IPCBroker(path, codec, envelope, **options)
 
 
-def create_broker(broker_url: str, **kwargs) -> BrokerInterface:
+def _create_mesh_broker(
+    address: str,
+    codec: Codec | str | None = None,
+    envelope: str = 'json',
+    **options,
+) -> BrokerInterface:
+    # _mesh builds on this module
+    from ._mesh import MeshBroker
+
+    return MeshBroker(address, codec=codec, envelope=envelope, **options)
+
+
+def _pop_url_option(broker_url: str, name: str) -> tuple[str, str | None]:
+    url = urlparse(broker_url)
+    query = parse_qsl(url.query)
+    values = [value for key, value in query if key == name]
+    if not values:
+        return broker_url, None
+    query = [(key, value) for key, value in query if key != name]
+    return url._replace(query=urlencode(query)).geturl(), values[-1]
+
+
+# the options create_broker reads from a url, with the function parsing
+# their value and the schemes of the brokers accepting them
+_COMPRESSION_SCHEMES = ('redis', 'redis-streams', 'ipc', 'mesh')
+_URL_OPTIONS = (
+    ('compression', str, _COMPRESSION_SCHEMES),
+    ('compression_threshold', int, _COMPRESSION_SCHEMES),
+    ('peers', lambda value: value.split(','), ('mesh',)),
+    ('seed', str, ('mesh',)),
+    ('advertise', str, ('mesh',)),
+)
+
+
+def _pop_url_options(broker_url: str, options: dict[str, Any]) -> str:
+    # keyword arguments win over url options
+    scheme = urlparse(broker_url).scheme
+    for name, parse, schemes in _URL_OPTIONS:
+        if scheme not in schemes:
+            continue
+        broker_url, value = _pop_url_option(broker_url, name)
+        if value is not None and name not in options:
+            options[name] = parse(value)
+    return broker_url
+
+
+def create_broker(
+    broker_url: str,
+    codec: Codec | str | None = None,
+    envelope: str | None = None,
+    **kwargs,
+) -> BrokerInterface:
+    '''
+    The envelope of the messages published to Redis can be set
+    either with the `envelope` keyword argument or in the url
+    (e.g. `redis://localhost:6379?envelope=binary`), as can their
+    `compression` and `compression_threshold`.
+    Other keyword arguments are passed to the broker (the Redis
+    brokers pass the ones they don't know to the Redis client).
+    `memory://<name>` urls share the `InMemoryHub` named `<name>`,
+    while every `memory://` broker has its own.
+    `ipc://<path>` urls connect the brokers of a host through the
+    Unix socket at `<path>`.
+    `mesh://<host>:<port>` (or `mesh://<path>`) urls create a node of
+    a peer mesh, whose `peers` (comma separated), `seed` and
+    `advertise` options can also be given in the url.
+    '''
+    broker_url, url_envelope = _pop_url_option(broker_url, 'envelope')
+    envelope = envelope or url_envelope or 'json'
+    broker_url = _pop_url_options(broker_url, kwargs)
     url = urlparse(broker_url)
     if url.scheme == 'redis':
-        return _create_redis_broker(broker_url)
+        return _create_redis_broker(broker_url, codec, envelope, **kwargs)
+    elif url.scheme == 'redis-streams':
+        return _create_redis_streams_broker(
+            url._replace(scheme='redis').geturl(), codec, envelope, **kwargs
+        )
     elif url.scheme == 'memory':
-        return _create_inmemory_broker()
+        return _create_inmemory_broker(codec, url.netloc, **kwargs)
+    elif url.scheme == 'mesh':
+        return _create_mesh_broker(
+            url.netloc or url.path, codec, envelope, **kwargs
+        )
+    elif url.scheme == 'ipc':
+        return _create_ipc_broker(
+            url.netloc + url.path, codec, envelope, **kwargs
+        )
     raise ValueError(f'Unknown broker url: {broker_url}')
@@ -0,0 +1,113 @@
+__all__ = ('Codec', 'JSONCodec', 'OrjsonCodec', 'MsgspecCodec', 'get_codec')
+
+import json
+from abc import ABC, abstractmethod
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+
+class Codec(ABC):
+    '''
+    Encodes and decodes JSON all along the message pipeline.
+    `dumps` produces text frames for the clients, while `dumpb`
+    produces the bytes published to the broker. `loads` accepts
+    both and raises `ValueError` on invalid input.
+    '''
+
+    name: str = ''
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> str:
+        ...
+
+    @abstractmethod
+    def dumpb(self, obj: Any) -> bytes:
+        ...
+
+    @abstractmethod
+    def loads(self, data: str | bytes) -> Any:
+        ...
+
+
+class JSONCodec(Codec):
+    name = 'json'
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+    def dumpb(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = 'orjson'
+
+    def __init__(self) -> None:
+        if orjson is None:
+            raise ImportError('orjson codec requires orjson to be installed')
+
+    def dumps(self, obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    def dumpb(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data: str | bytes) -> Any:
+        # orjson.JSONDecodeError is a ValueError
+        return orjson.loads(data)
+
+
+class MsgspecCodec(Codec):
+    name = 'msgspec'
+
+    def __init__(self) -> None:
+        if msgspec is None:
+            raise ImportError('msgspec codec requires msgspec to be installed')
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj: Any) -> str:
+        return self._encoder.encode(obj).decode()
+
+    def dumpb(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj)
+
+    def loads(self, data: str | bytes) -> Any:
+        try:
+            return self._decoder.decode(data)
+        except msgspec.DecodeError as exc:
+            raise ValueError(f'{exc}') from exc
+
+
+_CODECS: dict[str, type[Codec]] = {
+    'json': JSONCodec,
+    'orjson': OrjsonCodec,
+    'msgspec': MsgspecCodec,
+}
+_default_codec: Codec = JSONCodec()
+
+
+def get_codec(codec: Codec | str | None = None) -> Codec:
+    '''
+    Return `codec` if it is already a `Codec`, or build the one
+    registered with that name. Defaults to the stdlib `json`.
+    '''
+    if codec is None:
+        return _default_codec
+    if isinstance(codec, Codec):
+        return codec
+    if codec not in _CODECS:
+        raise ValueError(f'Unknown codec: {codec}')
+    return _CODECS[codec]()
@@ -0,0 +1,86 @@
+__all__ = (
+    'COMPRESSIONS',
+    'validate_compression',
+    'is_compressed',
+    'compress',
+    'decompress',
+    'FrameCompressor',
+)
+
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSIONS = ('zlib', 'zstd')
+
+# like the binary envelope magic, 0xff keeps compressed messages
+# apart from JSON ones, and the last byte from binary envelopes
+_MAGIC = b'\xffDZ'
+_ZLIB = 1
+_ZSTD = 2
+
+
+def validate_compression(compression: str | None) -> None:
+    if compression is None:
+        return
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression: {compression}')
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError(
+            'zstd compression requires zstandard to be installed'
+        )
+
+
+def is_compressed(data: object) -> bool:
+    return isinstance(data, (bytes, bytearray)) and data[:3] == _MAGIC
+
+
+def compress(data: bytes, compression: str = 'zlib') -> bytes:
+    '''
+    Compress an encoded message for the broker, prefixed so that
+    `decompress` (called by every node) recognizes it.
+    '''
+    if compression == 'zstd':
+        return _MAGIC + bytes((_ZSTD,)) + zstandard.compress(data)
+    return _MAGIC + bytes((_ZLIB,)) + zlib.compress(data)
+
+
+def decompress(data: bytes) -> bytes:
+    method, payload = data[3], data[4:]
+    if method == _ZLIB:
+        return zlib.decompress(payload)
+    if method == _ZSTD:
+        if zstandard is None:
+            raise ValueError('Received a zstd message without zstandard')
+        return zstandard.decompress(payload)
+    raise ValueError(f'Unsupported compression: {method}')
+
+
+class FrameCompressor:
+    '''
+    Deflates the frames sent to the clients (zlib format, at
+    `level`), remembering the last `cache_size` ones, so that
+    a frame queued for many connections is compressed once.
+    '''
+
+    def __init__(self, level: int = 6, cache_size: int = 16) -> None:
+        self.level: int = level
+        self.cache_size: int = cache_size
+        # frames are kept along with their id, that is only
+        # unique while the frame is alive
+        self._cache: OrderedDict[int, tuple[str, bytes]] = OrderedDict()
+
+    def compress(self, frame: str) -> bytes:
+        entry = self._cache.get(id(frame))
+        if entry is not None and entry[0] is frame:
+            self._cache.move_to_end(id(frame))
+            return entry[1]
+        data = zlib.compress(frame.encode(), self.level)
+        self._cache[id(frame)] = (frame, data)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return data
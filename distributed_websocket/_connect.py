@@ -0,0 +1,110 @@
+__all__ = ('is_connect_message', 'handle_connect_message')
+
+import math
+
+from ._compression import FrameCompressor
+from ._connection import Connection
+from ._exceptions import InvalidConnectMessage
+from ._message import Message
+
+
+def is_connect_message(message: Message) -> bool:
+    return message.typ == 'connect'
+
+
+def _is_number(value: object) -> bool:
+    # JSON codecs may decode Infinity and NaN
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) or (
+        isinstance(value, float) and math.isfinite(value)
+    )
+
+
+def _batch_options(
+    connection: Connection,
+    batch: object,
+    max_batch_size: int,
+    max_batch_delay: float,
+) -> dict | None:
+    if batch is True:
+        batch = {}
+    if batch is None or batch is False:
+        return None
+    if not isinstance(batch, dict):
+        raise InvalidConnectMessage(
+            f'Invalid batch options: {batch}', connection=connection
+        )
+    max_size = batch.get('max_size', max_batch_size)
+    max_delay = batch.get('max_delay', max_batch_delay)
+    if not (_is_number(max_size) and _is_number(max_delay)):
+        raise InvalidConnectMessage(
+            f'Invalid batch options: {batch}', connection=connection
+        )
+    max_size = min(int(max_size), max_batch_size)
+    if max_size < 2:
+        return None
+    return {
+        'max_size': max_size,
+        'max_delay': min(max(max_delay, 0), max_batch_delay),
+    }
+
+
+def _compress_options(
+    connection: Connection,
+    compress: object,
+    min_compression_threshold: int | None,
+) -> dict | None:
+    if compress is True:
+        compress = {}
+    if compress is None or compress is False:
+        return None
+    if not isinstance(compress, dict) or not _is_number(
+        compress.get('threshold', 0)
+    ):
+        raise InvalidConnectMessage(
+            f'Invalid compress options: {compress}', connection=connection
+        )
+    if min_compression_threshold is None:
+        return None
+    threshold = compress.get('threshold', min_compression_threshold)
+    return {'threshold': max(int(threshold), min_compression_threshold)}
+
+
+def handle_connect_message(
+    connection: Connection,
+    message: Message,
+    max_batch_size: int = 1,
+    max_batch_delay: float = 0.0,
+    min_compression_threshold: int | None = None,
+    compressor: FrameCompressor | None = None,
+) -> None:
+    '''
+    Apply the options requested by the client with a `connect`
+    message, and reply with the options in effect.
+    `batch` (`true`, or an object with `max_size` and `max_delay`)
+    asks for the messages to be sent in JSON arrays, limited by
+    `max_batch_size` and `max_batch_delay`.
+    `compress` (`true`, or an object with a `threshold`) asks for
+    the frames of at least `threshold` characters, and no less than
+    `min_compression_threshold`, to be sent deflated in binary
+    frames. Options left out are turned off.
+    '''
+    data = message.data if isinstance(message.data, dict) else {}
+    batch = _batch_options(
+        connection, data.get('batch'), max_batch_size, max_batch_delay
+    )
+    compress = _compress_options(
+        connection, data.get('compress'), min_compression_threshold
+    )
+    if batch is None:
+        connection.set_batching(None)
+    else:
+        connection.set_batching(batch['max_size'], batch['max_delay'])
+    if compress is None:
+        connection.set_compression(None)
+    else:
+        connection.set_compression(compress['threshold'], compressor)
+    connection.enqueue(
+        {'type': 'connect', 'batch': batch, 'compress': compress}
+    )
@@ -1,21 +1,64 @@
 __all__ = ('Connection',)
 
+import asyncio
+from collections import Counter
 from collections.abc import AsyncGenerator, AsyncIterator, Coroutine
 from typing import Any, Callable
 
 from fastapi import WebSocket, WebSocketDisconnect, status
 
-from ._message import Message, validate_incoming_message
+from ._codec import Codec, get_codec
+from ._compression import FrameCompressor
+from ._message import (
+    Message,
+    validate_incoming_batch,
+    validate_incoming_message,
+)
+from ._outbox import Outbox
 
 
 class Connection:
     def __init__(
-        self, websocket: WebSocket, conn_id: str, topic: str | None = None
+        self,
+        websocket: WebSocket,
+        conn_id: str,
+        topic: str | None = None,
+        *,
+        max_queue_size: int = 1024,
+        max_queue_bytes: int | None = None,
+        backpressure_policy: str = 'drop_newest',
+        backpressure_close_code: int = status.WS_1013_TRY_AGAIN_LATER,
+        on_backpressure: Callable[['Connection', str], Any] | None = None,
+        on_close: Callable[['Connection'], Any] | None = None,
+        codec: Codec | str | None = None,
+        conflate: bool = False,
+        batch_max_size: int | None = None,
+        batch_max_delay: float = 0.0,
+        compression_threshold: int | None = None,
+        compressor: FrameCompressor | None = None,
     ) -> None:
         self.websocket: WebSocket = websocket
         self.id: str = conn_id
+        self.codec: Codec = get_codec(codec)
         self.topics: set = {topic} if topic else set()
         self._message_generator: AsyncGenerator[None, Message] | None = None
+        self._outbox: Outbox = Outbox(
+            max_queue_size, max_queue_bytes, backpressure_policy
+        )
+        self.backpressure_close_code: int = backpressure_close_code
+        self.conflate: bool = conflate
+        self.batch_max_size: int | None = None
+        self.batch_max_delay: float = 0.0
+        self.set_batching(batch_max_size, batch_max_delay)
+        self.compression_threshold: int | None = None
+        self._compressor: FrameCompressor | None = None
+        self.set_compression(compression_threshold, compressor)
+        self.backpressure_events: Counter[str] = Counter()
+        self._on_backpressure = on_backpressure
+        self._on_close = on_close
+        self._writer_task: asyncio.Task | None = None
+        self._close_task: asyncio.Task | None = None
+        self.closed: bool = False
         self.accept: Callable[
             [str | None], Coroutine[Any, Any, None]
         ] = websocket.accept
@@ -25,21 +68,208 @@ class Connection:
         self.send_json: Callable[
             [Any, str], Coroutine[Any, Any, None]
         ] = websocket.send_json
+        self.send_text: Callable[
+            [str], Coroutine[Any, Any, None]
+        ] = websocket.send_text
+        self.send_bytes: Callable[
+            [bytes], Coroutine[Any, Any, None]
+        ] = websocket.send_bytes
         self.iter_json: Callable[[], AsyncIterator] = websocket.iter_json
 
     def __aiter__(self) -> AsyncIterator:
         return self
 
-    async def __anext__(self) -> Message:
+    async def receive_frame(self) -> str | bytes:
+        '''
+        Receive a text or binary frame, as is, so that it can be
+        decoded by `codec` without going through `str`.
+        '''
+        message = await self.websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect(message['code'])
+        if message.get('bytes') is not None:
+            return message['bytes']
+        return message['text']
+
+    async def __anext__(self) -> Message | list[Message] | None:
+        '''
+        Return the next message, or the list of messages sent by
+        the client in a JSON array. Invalid messages are answered
+        with an error, and return `None` (a batch with an invalid
+        message is rejected as a whole).
+        '''
         try:
-            data = await self.receive_json()
+            data = self.codec.loads(await self.receive_frame())
+            if isinstance(data, list):
+                validate_incoming_batch(data)
+                return [
+                    Message.from_client_message(data=item) for item in data
+                ]
             validate_incoming_message(data)
             return Message.from_client_message(data=data)
         except ValueError as exc:
-            await self.send_json({'error': f'{exc}'})
+            await self.send_error(f'{exc}')
             return None
         except WebSocketDisconnect:
             raise StopAsyncIteration from None
 
+    async def send_error(self, message: str) -> None:
+        '''
+        Send `{'error': message}`, encoded by `codec`. Once the writer
+        task has started, it is queued after the messages waiting to
+        be sent, instead of racing them on the socket.
+        '''
+        data = {'error': message}
+        if self._writer_task is not None:
+            self.enqueue(data)
+        else:
+            await self.send_text(self.codec.dumps(data))
+
+    def enqueue(
+        self, data: Any, key: Any = None, conflate: bool = False
+    ) -> bool:
+        '''
+        Queue `data` to be sent by the writer task, without waiting
+        for the socket. If the queue is full, the backpressure policy
+        is applied and counted in `backpressure_events`.
+        `key` (e.g. the message topic) identifies the messages that
+        the `conflate` policy can replace. With `conflate` (or if the
+        connection was created with `conflate=True`), `data` replaces
+        the queued message with the same `key` that has not been sent
+        yet, if any, so that only the latest one is sent.
+        Returns `False` if `data` has been dropped.
+        '''
+        return self.enqueue_frame(self.codec.dumps(data), key, conflate)
+
+    def enqueue_frame(
+        self, frame: str, key: Any = None, conflate: bool = False
+    ) -> bool:
+        '''
+        Same as `enqueue`, for data that has already been encoded,
+        so that a message for many connections is encoded only once.
+        '''
+        if self.closed or self._close_task is not None:
+            return False
+        event = self._outbox.put(frame, key, conflate or self.conflate)
+        if event is None:
+            return True
+        self.backpressure_events[event] += 1
+        if self._on_backpressure is not None:
+            self._on_backpressure(self, event)
+        if event == 'close':
+            self._outbox.clear()
+            self._close_task = asyncio.create_task(self._backpressure_close())
+        return event not in ('drop_newest', 'close')
+
+    @property
+    def queue_size(self) -> int:
+        return len(self._outbox)
+
+    @property
+    def queue_bytes(self) -> int:
+        return self._outbox.nbytes
+
+    @property
+    def conflated_messages(self) -> int:
+        return self._outbox.conflated
+
+    def set_batching(
+        self, max_size: int | None, max_delay: float = 0.0
+    ) -> None:
+        '''
+        Send the queued messages in JSON arrays of up to `max_size`
+        messages, waiting up to `max_delay` seconds after the first
+        one for the others. `None` sends every message on its own.
+        '''
+        if max_size is not None and max_size < 1:
+            raise ValueError(f'Invalid batch size: {max_size}')
+        if max_delay < 0:
+            raise ValueError(f'Invalid batch delay: {max_delay}')
+        self.batch_max_size = max_size
+        self.batch_max_delay = max_delay
+
+    def set_compression(
+        self,
+        threshold: int | None,
+        compressor: FrameCompressor | None = None,
+    ) -> None:
+        '''
+        Send the frames of at least `threshold` characters deflated
+        (zlib format) in binary frames, and the others as they are.
+        `None` sends every frame as it is. `compressor` can be shared
+        by connections, so that a frame sent to many of them is
+        compressed once.
+        '''
+        if threshold is not None and threshold < 0:
+            raise ValueError(f'Invalid compression threshold: {threshold}')
+        self.compression_threshold = threshold
+        if threshold is not None:
+            self._compressor = (
+                compressor or self._compressor or FrameCompressor()
+            )
+
+    async def _batch(self, frame: str, max_size: int, max_delay: float) -> str:
+        # the options are read once by the writer, `connect` messages
+        # can change them while it waits for more frames
+        if max_delay and len(self._outbox) < max_size - 1:
+            await asyncio.sleep(max_delay)
+        frames = [frame]
+        while self._outbox and len(frames) < max_size:
+            frames.append(self._outbox.get_nowait())
+        return f'[{",".join(frames)}]'
+
+    async def _write(self) -> None:
+        while True:
+            frame = await self._outbox.get()
+            max_size = self.batch_max_size
+            if max_size is not None:
+                frame = await self._batch(
+                    frame, max_size, self.batch_max_delay
+                )
+            try:
+                if (
+                    self.compression_threshold is not None
+                    and len(frame) >= self.compression_threshold
+                ):
+                    await self.send_bytes(self._compressor.compress(frame))
+                else:
+                    await self.send_text(frame)
+            except (WebSocketDisconnect, RuntimeError, OSError):
+                # the socket is gone, nothing more can be sent
+                self._writer_task = None
+                self.closed = True
+                self._outbox.clear()
+                self._closed_by_server()
+                return
+
+    async def _backpressure_close(self) -> None:
+        try:
+            await self.close(self.backpressure_close_code)
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            # the socket has already been closed
+            pass
+        self._closed_by_server()
+
+    def _closed_by_server(self) -> None:
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def start_writer(self) -> None:
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._write())
+
+    def stop_writer(self) -> None:
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+
     async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        '''
+        Stop the writer task and close the socket, once: closing
+        a closed connection does nothing.
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        self.stop_writer()
         await self.websocket.close(code)
@@ -0,0 +1,76 @@
+__all__ = ('Dispatcher',)
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Coroutine, Iterator
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    '''
+    Runs the coroutines delivering messages to the connections,
+    at most `max_concurrency` at a time (no limit if `None`),
+    queueing the others in order. Finished tasks are forgotten,
+    so iterating a dispatcher yields only the running tasks, and
+    the exceptions they raised are logged.
+    '''
+
+    def __init__(self, max_concurrency: int | None = None) -> None:
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f'Invalid max concurrency: {max_concurrency}')
+        self.max_concurrency: int | None = max_concurrency
+        self._tasks: set[asyncio.Task] = set()
+        self._queue: deque[Coroutine[Any, Any, None]] = deque()
+
+    def __iter__(self) -> Iterator[asyncio.Task]:
+        return iter(list(self._tasks))
+
+    def __len__(self) -> int:
+        return len(self._tasks) + len(self._queue)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def queue_depth(self) -> int:
+        '''
+        Number of coroutines waiting for a running task to finish.
+        '''
+        return len(self._queue)
+
+    def _full(self) -> bool:
+        return (
+            self.max_concurrency is not None
+            and len(self._tasks) >= self.max_concurrency
+        )
+
+    def submit(self, coro: Coroutine[Any, Any, None]) -> None:
+        if self._full():
+            self._queue.append(coro)
+        else:
+            self._start(coro)
+
+    def _start(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Dispatched task failed', exc_info=task.exception())
+        while self._queue and not self._full():
+            self._start(self._queue.popleft())
+
+    def cancel(self) -> None:
+        '''
+        Cancel the running tasks and drop the queued coroutines.
+        '''
+        while self._queue:
+            self._queue.popleft().close()
+        for task in list(self._tasks):
+            task.cancel()
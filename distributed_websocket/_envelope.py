@@ -0,0 +1,247 @@
+__all__ = (
+    'ENVELOPES',
+    'ORIGIN_KEY',
+    'validate_envelope',
+    'is_binary_envelope',
+    'pack_envelope',
+    'unpack_envelope',
+)
+
+import functools
+import struct
+from typing import Any
+
+from ._codec import Codec, get_codec
+from ._compression import compress, validate_compression
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+ENVELOPES = ('json', 'binary', 'msgpack')
+
+# payload key holding the id of the node publishing a message, so that
+# a node delivering locally can drop its own echo
+ORIGIN_KEY = '__node_id__'
+_ENVELOPE_KEYS = frozenset(('type', 'topic', 'conn_id'))
+
+# 0xff can't appear in UTF-8, so a binary envelope is never
+# mistaken for a JSON one (and viceversa) by a decoding node.
+_MAGIC = b'\xffDW'
+_VERSION = 1
+# magic, version, flags, type length, topic length, conn_id length
+_HEADER = struct.Struct('!3sBBBHH')
+_NO_TOPIC = 0x01
+_NO_CONN_ID = 0x02
+_MULTI_CONN_ID = 0x04
+_MSGPACK_PAYLOAD = 0x08
+
+
+def validate_envelope(envelope: str) -> None:
+    if envelope not in ENVELOPES:
+        raise ValueError(f'Unknown envelope: {envelope}')
+    if envelope == 'msgpack' and msgpack is None:
+        raise ImportError('msgpack envelope requires msgpack to be installed')
+
+
+def is_binary_envelope(data: Any) -> bool:
+    return isinstance(data, (bytes, bytearray)) and data[:3] == _MAGIC
+
+
+def pack_envelope(
+    message: Any,
+    envelope: str = 'json',
+    codec: Codec | None = None,
+    compression: str | None = None,
+    compression_threshold: int = 1024,
+) -> bytes:
+    '''
+    Encode a `Message`, or a serialized one (see
+    `Message.__serialize__`), for the broker. The `json` envelope
+    is the serialized message, while `binary` and `msgpack` put
+    type, topic and conn_id in a fixed header followed by the
+    payload, encoded by `codec` or by `msgpack` respectively.
+    The payload of a `Message` is encoded as it is, without
+    adding the envelope fields to it.
+    With `compression` (`zlib` or `zstd`), envelopes of at least
+    `compression_threshold` bytes are compressed.
+    '''
+    validate_envelope(envelope)
+    validate_compression(compression)
+    codec = get_codec(codec)
+    if isinstance(message, dict):
+        packed = _pack_dict(message, envelope, codec)
+    else:
+        packed = _pack_envelope(
+            message.typ,
+            message.topic,
+            message.conn_id,
+            message.data,
+            message.origin,
+            envelope,
+            codec,
+        )
+    if compression is not None and len(packed) >= compression_threshold:
+        return compress(packed, compression)
+    return packed
+
+
+def _pack_dict(data: dict, envelope: str, codec: Codec) -> bytes:
+    if envelope == 'json':
+        return codec.dumpb(data)
+    payload = {k: v for k, v in data.items() if k not in _ENVELOPE_KEYS}
+    return _pack_envelope(
+        data['type'],
+        data.get('topic'),
+        data.get('conn_id'),
+        payload,
+        None,
+        envelope,
+        codec,
+    )
+
+
+def _merge_objects(first: bytes, second: bytes) -> bytes:
+    # the keys of two encoded JSON objects in a single one, the
+    # ones of `second` last so that they win over duplicates
+    if first == b'{}':
+        return second
+    return b''.join((first[:-1], b',', second[1:]))
+
+
+@functools.lru_cache(maxsize=1024)
+def _encode_fields(
+    codec: Codec,
+    typ: str,
+    topic: str | None,
+    conn_id: str | list[str] | None,
+    origin: str | None,
+) -> bytes:
+    # the same for every message of a topic, hence the cache
+    fields = {'type': typ, 'topic': topic, 'conn_id': conn_id}
+    if origin is not None:
+        fields[ORIGIN_KEY] = origin
+    return codec.dumpb(fields)
+
+
+@functools.lru_cache(maxsize=64)
+def _encode_origin(codec: Codec, origin: str) -> bytes:
+    return codec.dumpb({ORIGIN_KEY: origin})
+
+
+def _pack_envelope(
+    typ: str,
+    topic: str | None,
+    conn_id: str | list[str] | None,
+    payload: Any,
+    origin: str | None,
+    envelope: str,
+    codec: Codec,
+) -> bytes:
+    if envelope == 'json':
+        return _pack_json_envelope(typ, topic, conn_id, payload, origin, codec)
+    return _pack_binary_envelope(
+        typ, topic, conn_id, payload, origin, envelope, codec
+    )
+
+
+def _pack_json_envelope(
+    typ: str,
+    topic: str | None,
+    conn_id: str | list[str] | None,
+    payload: Any,
+    origin: str | None,
+    codec: Codec,
+) -> bytes:
+    if isinstance(conn_id, list):
+        fields = _encode_fields.__wrapped__(codec, typ, topic, conn_id, origin)
+    else:
+        fields = _encode_fields(codec, typ, topic, conn_id, origin)
+    return _merge_objects(codec.dumpb(payload), fields)
+
+
+def _pack_binary_envelope(
+    typ: str,
+    topic: str | None,
+    conn_id: str | list[str] | None,
+    payload: Any,
+    origin: str | None,
+    envelope: str,
+    codec: Codec,
+) -> bytes:
+    typ_bytes = typ.encode()
+    topic_bytes = topic.encode() if topic is not None else b''
+    if conn_id is None:
+        conn_id_bytes = b''
+    elif isinstance(conn_id, list):
+        conn_id_bytes = codec.dumpb(conn_id)
+    else:
+        conn_id_bytes = conn_id.encode()
+    if (
+        len(typ_bytes) > 0xFF
+        or len(topic_bytes) > 0xFFFF
+        or len(conn_id_bytes) > 0xFFFF
+    ):
+        # too long for the header, every node decodes JSON envelopes
+        return _pack_json_envelope(typ, topic, conn_id, payload, origin, codec)
+    flags = _header_flags(topic, conn_id)
+    if envelope == 'msgpack':
+        flags |= _MSGPACK_PAYLOAD
+        if origin is not None:
+            payload = {**payload, ORIGIN_KEY: origin}
+        payload = msgpack.packb(payload)
+    else:
+        payload = codec.dumpb(payload)
+        if origin is not None:
+            payload = _merge_objects(payload, _encode_origin(codec, origin))
+    header = _HEADER.pack(
+        _MAGIC,
+        _VERSION,
+        flags,
+        len(typ_bytes),
+        len(topic_bytes),
+        len(conn_id_bytes),
+    )
+    return b''.join((header, typ_bytes, topic_bytes, conn_id_bytes, payload))
+
+
+def _header_flags(topic: str | None, conn_id: str | list[str] | None) -> int:
+    flags = 0
+    if topic is None:
+        flags |= _NO_TOPIC
+    if conn_id is None:
+        flags |= _NO_CONN_ID
+    elif isinstance(conn_id, list):
+        flags |= _MULTI_CONN_ID
+    return flags
+
+
+def unpack_envelope(data: bytes, codec: Codec | None = None) -> tuple:
+    _, version, flags, typ_len, topic_len, conn_id_len = _HEADER.unpack_from(
+        data
+    )
+    if version != _VERSION:
+        raise ValueError(f'Unsupported envelope version: {version}')
+    start = _HEADER.size
+    end = start + typ_len
+    typ = data[start:end].decode()
+    start, end = end, end + topic_len
+    topic = None if flags & _NO_TOPIC else data[start:end].decode()
+    start, end = end, end + conn_id_len
+    conn_id_bytes = data[start:end]
+    start = end
+    codec = get_codec(codec)
+    if flags & _NO_CONN_ID:
+        conn_id = None
+    elif flags & _MULTI_CONN_ID:
+        conn_id = codec.loads(conn_id_bytes)
+    else:
+        conn_id = conn_id_bytes.decode()
+    if flags & _MSGPACK_PAYLOAD:
+        if msgpack is None:
+            raise ValueError('Received a msgpack envelope without msgpack')
+        payload = msgpack.unpackb(data[start:])
+    else:
+        payload = codec.loads(data[start:])
+    return typ, topic, conn_id, payload
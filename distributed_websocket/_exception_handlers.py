@@ -4,4 +4,4 @@ from ._exceptions import WebSocketException
 
 
 async def send_error_message(exc: WebSocketException) -> None:
-    await exc.connection.send_json({'error': exc.message})
+    await exc.connection.send_error(exc.message)
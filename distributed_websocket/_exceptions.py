@@ -2,6 +2,7 @@ __all__ = (
     'WebSocketException',
     'InvalidSubscription',
     'InvalidSubscriptionMessage',
+    'InvalidConnectMessage',
 )
 
 from ._connection import Connection
@@ -38,3 +39,11 @@ class InvalidSubscriptionMessage(WebSocketException):
     '''
 
     ...
+
+
+class InvalidConnectMessage(WebSocketException):
+    '''
+    Raised when the options of a `connect` message are invalid.
+    '''
+
+    ...
@@ -0,0 +1,50 @@
+__all__ = (
+    'SUBSCRIBE',
+    'UNSUBSCRIBE',
+    'PSUBSCRIBE',
+    'PUNSUBSCRIBE',
+    'PUBLISH',
+    'MESSAGE',
+    'HELLO',
+    'PEERS',
+    'pack_frame',
+    'read_frame',
+)
+
+import asyncio
+import struct
+
+# Frames exchanged over the sockets of the ipc and mesh brokers:
+# frame length (excluded), operation, channel length, channel, data
+_HEADER = struct.Struct('!IBH')
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+PSUBSCRIBE = 3
+PUNSUBSCRIBE = 4
+PUBLISH = 5
+MESSAGE = 6
+HELLO = 7
+PEERS = 8
+
+
+def pack_frame(op: int, channel: str, data: bytes = b'') -> bytes:
+    channel_bytes = channel.encode()
+    return b''.join(
+        (
+            _HEADER.pack(
+                _HEADER.size - 4 + len(channel_bytes) + len(data),
+                op,
+                len(channel_bytes),
+            ),
+            channel_bytes,
+            data,
+        )
+    )
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[int, str, bytes]:
+    length = int.from_bytes(await reader.readexactly(4), 'big')
+    body = await reader.readexactly(length)
+    op, channel_length = body[0], int.from_bytes(body[1:3], 'big')
+    end = 3 + channel_length
+    return op, body[3:end].decode(), body[end:]
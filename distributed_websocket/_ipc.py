@@ -0,0 +1,295 @@
+__all__ = ('IPCHub', 'IPCBroker')
+
+import asyncio
+import fcntl
+import os
+import re
+from collections.abc import Iterable
+from typing import Any
+
+from ._broker import BrokerInterface, _encode_message, _glob_to_regex
+from ._codec import Codec, get_codec
+from ._compression import validate_compression
+from ._envelope import validate_envelope
+from ._framing import (
+    MESSAGE,
+    PSUBSCRIBE,
+    PUBLISH,
+    PUNSUBSCRIBE,
+    SUBSCRIBE,
+    UNSUBSCRIBE,
+    pack_frame,
+    read_frame,
+)
+from ._message import Message
+
+
+class _Peer:
+    __slots__ = ('writer', 'channels', 'patterns')
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer: asyncio.StreamWriter = writer
+        self.channels: set[str] = set()
+        self.patterns: dict[str, re.Pattern] = {}
+
+    def subscribed(self, channel: str) -> bool:
+        return channel in self.channels or any(
+            regex.fullmatch(channel) for regex in self.patterns.values()
+        )
+
+
+class IPCHub:
+    '''
+    Unix socket server relaying messages between the `IPCBroker`s
+    of one host. It runs inside the process of one of the brokers,
+    see `IPCBroker`. Messages for a peer whose socket buffer holds
+    more than `max_buffer_size` bytes are dropped, and counted in
+    `dropped_messages`.
+    '''
+
+    def __init__(self, path: str, max_buffer_size: int = 2**24) -> None:
+        self.path: str = path
+        self.max_buffer_size: int = max_buffer_size
+        self.dropped_messages: int = 0
+        self._server: asyncio.AbstractServer | None = None
+        self._peers: set[_Peer] = set()
+        self._handlers: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            # left behind by a hub that died
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=self.path
+        )
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        for peer in list(self._peers):
+            peer.writer.close()
+        for task in self._handlers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        peer = _Peer(writer)
+        self._peers.add(peer)
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                op, channel, data = await read_frame(reader)
+                if op == PUBLISH:
+                    self._publish(channel, data)
+                elif op == SUBSCRIBE:
+                    peer.channels.add(channel)
+                elif op == UNSUBSCRIBE:
+                    peer.channels.discard(channel)
+                elif op == PSUBSCRIBE:
+                    peer.patterns[channel] = _glob_to_regex(channel)
+                elif op == PUNSUBSCRIBE:
+                    peer.patterns.pop(channel, None)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # by `close`: the stream protocol logs handlers that end
+            # cancelled, so this one returns
+            pass
+        finally:
+            self._handlers.discard(task)
+            self._peers.discard(peer)
+            writer.close()
+
+    def _publish(self, channel: str, data: bytes) -> None:
+        frame = None
+        for peer in self._peers:
+            if not peer.subscribed(channel):
+                continue
+            transport = peer.writer.transport
+            if transport.get_write_buffer_size() > self.max_buffer_size:
+                self.dropped_messages += 1
+                continue
+            if frame is None:
+                frame = pack_frame(MESSAGE, channel, data)
+            peer.writer.write(frame)
+
+
+class IPCBroker(BrokerInterface):
+    '''
+    Broker for the worker processes of a single host, connected by
+    a Unix socket at `path` to an `IPCHub` instead of going through
+    an external server. The first broker that takes the lock on
+    `<path>.lock` runs the hub, and the others connect to it.
+    If the hub goes away, the brokers elect a new one the same way
+    and subscribe again.
+    Messages wait for `get_message` in a queue of `max_queue_size`
+    messages, dropping the oldest one when full.
+    '''
+
+    supports_psubscribe = True
+
+    def __init__(
+        self,
+        path: str,
+        codec: Codec | str | None = None,
+        envelope: str = 'json',
+        max_queue_size: int = 1024,
+        reconnect_delay: float = 0.05,
+        compression: str | None = None,
+        compression_threshold: int = 1024,
+    ) -> None:
+        validate_envelope(envelope)
+        validate_compression(compression)
+        self.path: str = path
+        self.codec: Codec = get_codec(codec)
+        self.envelope: str = envelope
+        self.compression: str | None = compression
+        self.compression_threshold: int = compression_threshold
+        self.reconnect_delay: float = reconnect_delay
+        self.dropped_messages: int = 0
+        self.hub: IPCHub | None = None
+        self._lock_fd: int | None = None
+        self._channels: set[str] = set()
+        self._patterns: set[str] = set()
+        self._messages: asyncio.Queue = asyncio.Queue(max_queue_size)
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task | None = None
+
+    async def __aenter__(self) -> BrokerInterface:
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.disconnect()
+
+    def _acquire_hub_lock(self) -> bool:
+        fd = os.open(f'{self.path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _release_hub_lock(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def _open(self) -> asyncio.StreamReader:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        while True:
+            if self.hub is None and self._acquire_hub_lock():
+                self.hub = IPCHub(self.path)
+                await self.hub.start()
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(
+                    self.path
+                )
+            except (FileNotFoundError, ConnectionError):
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            for channel in self._channels:
+                self._writer.write(pack_frame(SUBSCRIBE, channel))
+            for pattern in self._patterns:
+                self._writer.write(pack_frame(PSUBSCRIBE, pattern))
+            await self._writer.drain()
+            return reader
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            try:
+                op, channel, data = await read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                reader = await self._open()
+                continue
+            if op != MESSAGE:
+                continue
+            if self._messages.full():
+                self._messages.get_nowait()
+                self.dropped_messages += 1
+            self._messages.put_nowait(data)
+
+    async def connect(self) -> None:
+        if self._reader_task is None:
+            reader = await self._open()
+            self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def disconnect(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.hub is not None:
+            await self.hub.close()
+            self.hub = None
+        self._release_hub_lock()
+
+    async def _send(self, frame: bytes) -> None:
+        if self._writer is None:
+            # not connected yet, subscriptions are sent on connection
+            return
+        self._writer.write(frame)
+        await self._writer.drain()
+
+    async def subscribe(self, channel: str) -> None:
+        self._channels.add(channel)
+        await self._send(pack_frame(SUBSCRIBE, channel))
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._channels.discard(channel)
+        await self._send(pack_frame(UNSUBSCRIBE, channel))
+
+    async def psubscribe(self, pattern: str) -> None:
+        self._patterns.add(pattern)
+        await self._send(pack_frame(PSUBSCRIBE, pattern))
+
+    async def punsubscribe(self, pattern: str) -> None:
+        self._patterns.discard(pattern)
+        await self._send(pack_frame(PUNSUBSCRIBE, pattern))
+
+    async def publish(self, channel: str, message: Any) -> None:
+        message = _encode_message(self, message)
+        if isinstance(message, str):
+            message = message.encode()
+        if self._writer is None:
+            raise ConnectionError('IPCBroker is not connected')
+        await self._send(pack_frame(PUBLISH, channel, message))
+
+    async def publish_many(self, messages: Iterable[tuple[str, Any]]) -> None:
+        frames = []
+        for channel, message in messages:
+            message = _encode_message(self, message)
+            if isinstance(message, str):
+                message = message.encode()
+            frames.append(pack_frame(PUBLISH, channel, message))
+        if self._writer is None:
+            raise ConnectionError('IPCBroker is not connected')
+        await self._send(b''.join(frames))
+
+    def _to_message(self, data: bytes) -> Message:
+        return Message.from_broker_message(data, self.codec)
+
+    async def get_message(self, **kwargs) -> Message | None:
+        return self._to_message(await self._messages.get())
+
+    async def get_messages(
+        self, max_count: int = 100, **kwargs
+    ) -> list[Message]:
+        messages = [await self._messages.get()]
+        while len(messages) < max_count and not self._messages.empty():
+            messages.append(self._messages.get_nowait())
+        return [self._to_message(data) for data in messages]
@@ -1,20 +1,278 @@
-__all__ = ('matches',)
+__all__ = ('matches', 'compile_pattern', 'Pattern', 'PatternTrie')
+
+from collections import OrderedDict
+from functools import lru_cache
+
+
+def _common_suffix_length(a: str, b: str) -> int:
+    size = min(len(a), len(b))
+    length = 0
+    while length < size and a[-1 - length] == b[-1 - length]:
+        length += 1
+    return length
 
 
 def _match_topic_with_wildcards(topic: str, pattern: str) -> bool:
-    return (
-        topic == pattern
-        or '#' == pattern[:1]
-        or pattern[:1] in (topic[:1], '+')
-        and _match_topic_with_wildcards(
-            topic[1:],
-            pattern['+' != pattern[:1] or (topic[:1] in '/') * 2:]  # fmt: skip
+    '''
+    Character by character matching, where `+` consumes a run of
+    non `/` characters and `#` accepts whatever follows.
+    Walks both strings with indexes instead of recursing on slices.
+    '''
+    topic_length, pattern_length = len(topic), len(pattern)
+    # topic[t:] == pattern[p:] iff both rests have the same length
+    # and that length fits in the common suffix of the two strings
+    suffix = _common_suffix_length(topic, pattern)
+    t = p = 0
+    while True:
+        rest = topic_length - t
+        if rest == max(pattern_length - p, 0) and rest <= suffix:
+            return True
+        char = pattern[p] if p < pattern_length else ''
+        if char == '#':
+            return True
+        if char == '+':
+            if t == topic_length or topic[t] == '/':
+                p += 2
+        elif char and t < topic_length and char == topic[t]:
+            p += 1
+        else:
+            return False
+        if t < topic_length:
+            t += 1
+
+
+def _is_segment_pattern(pattern: str) -> bool:
+    '''
+    Patterns whose wildcards take up whole segments can be matched
+    segment by segment. Anything else (e.g. `a/b+`) is matched
+    character by character.
+    '''
+    for segment in pattern.split('/'):
+        if segment not in ('+', '#') and ('+' in segment or '#' in segment):
+            return False
+    return True
+
+
+def _accepts_empty(segments: list[str], start: int) -> bool:
+    # What is left of a pattern once the topic ran out under a `+`:
+    # it can only be further `+`, a `#` or a single trailing `/`.
+    last = len(segments) - 1
+    for i in range(start, last + 1):
+        segment = segments[i]
+        if segment == '#':
+            return True
+        if segment != '+':
+            return segment == '' and i == last
+    return True
+
+
+def _match_segments(segments: list[str], topic: str) -> bool:
+    parts = topic.split('/')
+    last_part, last_segment = len(parts) - 1, len(segments) - 1
+    for i, segment in enumerate(segments):
+        if segment == '#':
+            return True
+        if segment == '+':
+            if i == last_part:
+                return _accepts_empty(segments, i + 1)
+            if i == last_segment:
+                # a trailing `+` also swallows a single trailing `/`
+                return last_part == i + 1 and parts[-1] == ''
+        elif segment != parts[i]:
+            return False
+        elif i == last_part or i == last_segment:
+            return last_part == last_segment
+    return False
+
+
+class Pattern:
+    '''
+    A subscription pattern compiled to its topic segments.
+    '''
+
+    __slots__ = ('pattern', 'segments')
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern: str = pattern
+        self.segments: list[str] | None = (
+            pattern.split('/') if _is_segment_pattern(pattern) else None
         )
-    )
+
+    def __repr__(self) -> str:
+        return f'Pattern({self.pattern!r})'
+
+    def match(self, topic: str) -> bool:
+        if self.segments is None:
+            return _match_topic_with_wildcards(topic, self.pattern)
+        return _match_segments(self.segments, topic)
+
+
+@lru_cache(maxsize=4096)
+def compile_pattern(pattern: str) -> Pattern:
+    return Pattern(pattern)
 
 
 def matches(topic: str, patterns: set) -> bool:
     for pattern in patterns:
-        if _match_topic_with_wildcards(topic, pattern):
+        if compile_pattern(pattern).match(topic):
             return True
     return False
+
+
+class _Node:
+    __slots__ = ('children', 'patterns')
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.patterns: set[str] = set()
+
+
+class PatternTrie:
+    '''
+    Inverted index of subscription patterns, one trie level per
+    topic segment with `+` and `#` stored as regular children.
+    `match` yields the same patterns that `matches` would accept,
+    visiting only the branches that the topic can reach.
+    Results are kept in a LRU cache of `cache_size` topics, that
+    is patched, rather than dropped, when patterns change.
+    '''
+
+    def __init__(self, cache_size: int = 1024) -> None:
+        self._root: _Node = _Node()
+        self._unstructured: dict[str, Pattern] = {}
+        self._size: int = 0
+        self._cache: OrderedDict[str, frozenset[str]] = OrderedDict()
+        self._cache_size: int = cache_size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, pattern: str) -> bool:
+        if not _is_segment_pattern(pattern):
+            return pattern in self._unstructured
+        node = self._find(pattern)
+        return node is not None and pattern in node.patterns
+
+    @staticmethod
+    def _segments(pattern: str) -> list[str]:
+        segments = pattern.split('/')
+        if '#' in segments:
+            # everything after a `#` is never looked at
+            return segments[: segments.index('#') + 1]
+        return segments
+
+    def _find(self, pattern: str) -> _Node | None:
+        node = self._root
+        for segment in self._segments(pattern):
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def add(self, pattern: str) -> None:
+        if pattern in self:
+            return
+        compiled = compile_pattern(pattern)
+        if compiled.segments is not None:
+            node = self._root
+            for segment in self._segments(pattern):
+                node = node.children.setdefault(segment, _Node())
+            node.patterns.add(pattern)
+        else:
+            self._unstructured[pattern] = compiled
+        self._size += 1
+        for topic, cached in self._cache.items():
+            if compiled.match(topic):
+                self._cache[topic] = cached | {pattern}
+
+    def discard(self, pattern: str) -> None:
+        if pattern not in self:
+            return
+        self._size -= 1
+        for topic, cached in self._cache.items():
+            if pattern in cached:
+                self._cache[topic] = cached - {pattern}
+        if not _is_segment_pattern(pattern):
+            del self._unstructured[pattern]
+            return
+        path = [self._root]
+        segments = self._segments(pattern)
+        for segment in segments:
+            path.append(path[-1].children[segment])
+        path[-1].patterns.discard(pattern)
+        for depth in range(len(segments), 0, -1):
+            node = path[depth]
+            if node.patterns or node.children:
+                break
+            del path[depth - 1].children[segments[depth - 1]]
+
+    @staticmethod
+    def _collect_exhausted(node: _Node | None, result: set[str]) -> None:
+        # The topic ran out while a `+` was consuming it: the rest of
+        # the pattern is matched against an empty string, which only
+        # accepts further `+`, a `#`, or a single trailing `/`.
+        while node is not None:
+            result |= node.patterns
+            for segment in ('', '#'):
+                child = node.children.get(segment)
+                if child is not None:
+                    result |= child.patterns
+            node = node.children.get('+')
+
+    def match(self, topic: str) -> frozenset[str]:
+        if topic is None:
+            return frozenset()
+        cached = self._cache.get(topic)
+        if cached is not None:
+            self._cache.move_to_end(topic)
+            return cached
+        result = frozenset(self._match(topic))
+        if self._cache_size > 0:
+            self._cache[topic] = result
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _match(self, topic: str) -> set[str]:
+        result: set[str] = set()
+        segments = topic.split('/')
+        stack = [(self._root, 0)]
+        while stack:
+            node, i = stack.pop()
+            self._match_node(node, segments, i, result, stack)
+        for pattern, compiled in self._unstructured.items():
+            if compiled.match(topic):
+                result.add(pattern)
+        return result
+
+    def _match_node(
+        self,
+        node: _Node,
+        segments: list[str],
+        i: int,
+        result: set[str],
+        stack: list[tuple[_Node, int]],
+    ) -> None:
+        # add the patterns of `node` matched by segment `i` to
+        # `result`, and the children to walk next to `stack`
+        last = len(segments) - 1
+        children = node.children
+        child = children.get('#')
+        if child is not None:
+            result |= child.patterns
+        segment = segments[i]
+        if segment not in ('+', '#'):
+            child = children.get(segment)
+            if child is not None:
+                if i == last:
+                    result |= child.patterns
+                else:
+                    stack.append((child, i + 1))
+        child = children.get('+')
+        if child is not None:
+            if i == last:
+                self._collect_exhausted(child, result)
+            else:
+                stack.append((child, i + 1))
+                if i + 1 == last and segments[last] == '':
+                    result |= child.patterns
@@ -0,0 +1,308 @@
+__all__ = ('MeshBroker',)
+
+import asyncio
+import re
+from collections.abc import Iterable
+from typing import Any
+
+from ._broker import BrokerInterface, _encode_message, _glob_to_regex
+from ._codec import Codec, get_codec
+from ._compression import validate_compression
+from ._envelope import validate_envelope
+from ._framing import (
+    HELLO,
+    MESSAGE,
+    PEERS,
+    PSUBSCRIBE,
+    PUNSUBSCRIBE,
+    SUBSCRIBE,
+    UNSUBSCRIBE,
+    pack_frame,
+    read_frame,
+)
+from ._message import Message
+
+
+async def _open_connection(
+    address: str,
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if address.startswith('/'):
+        return await asyncio.open_unix_connection(address)
+    host, port = address.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+class _Subscriptions:
+    __slots__ = ('channels', 'patterns')
+
+    def __init__(self) -> None:
+        self.channels: set[str] = set()
+        self.patterns: dict[str, re.Pattern] = {}
+
+    def update(self, op: int, channel: str) -> None:
+        if op == SUBSCRIBE:
+            self.channels.add(channel)
+        elif op == UNSUBSCRIBE:
+            self.channels.discard(channel)
+        elif op == PSUBSCRIBE:
+            self.patterns[channel] = _glob_to_regex(channel)
+        elif op == PUNSUBSCRIBE:
+            self.patterns.pop(channel, None)
+
+    def frames(self) -> list[bytes]:
+        return [pack_frame(SUBSCRIBE, c) for c in self.channels] + [
+            pack_frame(PSUBSCRIBE, p) for p in self.patterns
+        ]
+
+    def match(self, channel: str) -> bool:
+        return channel in self.channels or any(
+            regex.fullmatch(channel) for regex in self.patterns.values()
+        )
+
+
+class _Link:
+    __slots__ = ('address', 'writer', 'task')
+
+    def __init__(self, address: str) -> None:
+        self.address: str = address
+        self.writer: asyncio.StreamWriter | None = None
+        self.task: asyncio.Task | None = None
+
+
+class MeshBroker(BrokerInterface):
+    '''
+    Brokerless backend for small clusters: every node listens on
+    `address` (`host:port`, or the path of a Unix socket) and keeps
+    a connection to every other node, so a message takes one hop.
+
+    Nodes are found from the static `peers` list and from `seed`:
+    a node sends to each node it connects to the addresses it knows,
+    and connects back to the nodes that connect to it, so joining
+    through a single seed node is enough to get a full mesh.
+    Each node tells the others which channels it is subscribed to,
+    so messages are only sent to the nodes interested in them.
+    `advertise` is the address the other nodes connect to, `address`
+    by default (with the actual port if `address` uses port 0).
+    Messages for a node whose socket buffer holds more than
+    `max_buffer_size` bytes are dropped, as are the oldest received
+    messages once `max_queue_size` are waiting, and both are counted
+    in `dropped_messages`.
+    '''
+
+    supports_psubscribe = True
+
+    def __init__(
+        self,
+        address: str,
+        peers: Iterable[str] = (),
+        seed: str | None = None,
+        advertise: str | None = None,
+        codec: Codec | str | None = None,
+        envelope: str = 'json',
+        max_queue_size: int = 1024,
+        max_buffer_size: int = 2**24,
+        reconnect_delay: float = 0.1,
+        max_reconnect_delay: float = 5.0,
+        compression: str | None = None,
+        compression_threshold: int = 1024,
+    ) -> None:
+        validate_envelope(envelope)
+        validate_compression(compression)
+        self.address: str = address
+        self.advertise: str | None = advertise
+        self.codec: Codec = get_codec(codec)
+        self.envelope: str = envelope
+        self.compression: str | None = compression
+        self.compression_threshold: int = compression_threshold
+        self.max_buffer_size: int = max_buffer_size
+        self.reconnect_delay: float = reconnect_delay
+        self.max_reconnect_delay: float = max_reconnect_delay
+        self.dropped_messages: int = 0
+        self._initial_peers: list[str] = list(peers)
+        if seed is not None:
+            self._initial_peers.append(seed)
+        self._subscriptions: _Subscriptions = _Subscriptions()
+        # outgoing connections, and the subscriptions of the nodes
+        # they lead to, received on the incoming connections
+        self._links: dict[str, _Link] = {}
+        self._remote: dict[str, _Subscriptions] = {}
+        self._incoming: set[asyncio.StreamWriter] = set()
+        self._messages: asyncio.Queue = asyncio.Queue(max_queue_size)
+        self._server: asyncio.AbstractServer | None = None
+
+    async def __aenter__(self) -> BrokerInterface:
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.disconnect()
+
+    @property
+    def peers(self) -> set[str]:
+        '''
+        The addresses of the nodes this node is connected to.
+        '''
+        return {
+            address
+            for address, link in self._links.items()
+            if link.writer is not None
+        }
+
+    async def connect(self) -> None:
+        if self._server is not None:
+            return
+        if self.address.startswith('/'):
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=self.address
+            )
+            self.advertise = self.advertise or self.address
+        else:
+            host, port = self.address.rsplit(':', 1)
+            self._server = await asyncio.start_server(
+                self._handle, host, int(port)
+            )
+            if self.advertise is None:
+                port = self._server.sockets[0].getsockname()[1]
+                self.advertise = f'{host}:{port}'
+        for address in self._initial_peers:
+            self._add_peer(address)
+
+    async def disconnect(self) -> None:
+        for link in self._links.values():
+            link.task.cancel()
+            if link.writer is not None:
+                link.writer.close()
+        self._links.clear()
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._incoming):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._remote.clear()
+
+    def _add_peer(self, address: str) -> None:
+        if address == self.advertise or address in self._links:
+            return
+        link = self._links[address] = _Link(address)
+        link.task = asyncio.create_task(self._run_link(link))
+
+    async def _run_link(self, link: _Link) -> None:
+        delay = self.reconnect_delay
+        while True:
+            try:
+                reader, writer = await _open_connection(link.address)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            delay = self.reconnect_delay
+            writer.write(pack_frame(HELLO, self.advertise))
+            writer.write(
+                pack_frame(PEERS, '', '\n'.join(self._links).encode())
+            )
+            for frame in self._subscriptions.frames():
+                writer.write(frame)
+            link.writer = writer
+            try:
+                await writer.drain()
+                # nothing comes back on outgoing connections,
+                # just wait for the other node to close it
+                await reader.read()
+            except ConnectionError:
+                pass
+            link.writer = None
+            writer.close()
+            await asyncio.sleep(delay)
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._incoming.add(writer)
+        address = subscriptions = None
+        try:
+            while True:
+                op, channel, data = await read_frame(reader)
+                if op == MESSAGE:
+                    self._put(data)
+                elif op == HELLO:
+                    address = channel
+                    subscriptions = self._remote[address] = _Subscriptions()
+                    self._add_peer(address)
+                elif op == PEERS:
+                    for peer in data.decode().split('\n'):
+                        if peer:
+                            self._add_peer(peer)
+                elif subscriptions is not None:
+                    subscriptions.update(op, channel)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._incoming.discard(writer)
+            if self._remote.get(address) is subscriptions:
+                self._remote.pop(address, None)
+            writer.close()
+
+    def _put(self, data: bytes) -> None:
+        if self._messages.full():
+            self._messages.get_nowait()
+            self.dropped_messages += 1
+        self._messages.put_nowait(data)
+
+    def _broadcast(self, frame: bytes) -> None:
+        for link in self._links.values():
+            if link.writer is not None:
+                link.writer.write(frame)
+
+    async def subscribe(self, channel: str) -> None:
+        self._subscriptions.update(SUBSCRIBE, channel)
+        self._broadcast(pack_frame(SUBSCRIBE, channel))
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._subscriptions.update(UNSUBSCRIBE, channel)
+        self._broadcast(pack_frame(UNSUBSCRIBE, channel))
+
+    async def psubscribe(self, pattern: str) -> None:
+        self._subscriptions.update(PSUBSCRIBE, pattern)
+        self._broadcast(pack_frame(PSUBSCRIBE, pattern))
+
+    async def punsubscribe(self, pattern: str) -> None:
+        self._subscriptions.update(PUNSUBSCRIBE, pattern)
+        self._broadcast(pack_frame(PUNSUBSCRIBE, pattern))
+
+    async def publish(self, channel: str, message: Any) -> None:
+        message = _encode_message(self, message)
+        if isinstance(message, str):
+            message = message.encode()
+        if self._subscriptions.match(channel):
+            self._put(message)
+        frame = None
+        for address, subscriptions in self._remote.items():
+            link = self._links.get(address)
+            if (
+                link is None
+                or link.writer is None
+                or not subscriptions.match(channel)
+            ):
+                continue
+            transport = link.writer.transport
+            if transport.get_write_buffer_size() > self.max_buffer_size:
+                self.dropped_messages += 1
+                continue
+            if frame is None:
+                frame = pack_frame(MESSAGE, channel, message)
+            link.writer.write(frame)
+
+    def _to_message(self, data: bytes) -> Message:
+        return Message.from_broker_message(data, self.codec)
+
+    async def get_message(self, **kwargs) -> Message | None:
+        return self._to_message(await self._messages.get())
+
+    async def get_messages(
+        self, max_count: int = 100, **kwargs
+    ) -> list[Message]:
+        messages = [await self._messages.get()]
+        while len(messages) < max_count and not self._messages.empty():
+            messages.append(self._messages.get_nowait())
+        return [self._to_message(data) for data in messages]
@@ -1,14 +1,16 @@
 __all__ = (
     'tag_client_message',
     'validate_incoming_message',
+    'validate_incoming_batch',
     'untag_broker_message',
     'Message',
 )
 
-import json
 from typing import Any
 
-from .utils import update
+from ._codec import Codec, get_codec
+from ._compression import decompress, is_compressed
+from ._envelope import ORIGIN_KEY, is_binary_envelope, unpack_envelope
 
 __VALID_TYPES = {
     'connect',
@@ -39,9 +41,8 @@ def is_valid_type_client_message(data: dict) -> bool:
 
 
 def tag_client_message(data: dict) -> Any:
-    topic = data.get('topic', None)
-    if topic is None:
-        return update(data, **{'type': 'broadcast'})
+    if data.get('topic', None) is None:
+        data['type'] = 'broadcast'
     return data
 
 
@@ -59,28 +60,65 @@ def validate_incoming_message(data: dict) -> None:
         raise ValueError(f'Invalid message type "{typ}" with no conn_id')
 
 
-def untag_broker_message(data: dict | str) -> tuple:
+def validate_incoming_batch(data: list) -> None:
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise ValueError(f'Invalid message at index {i}: not an object')
+        try:
+            validate_incoming_message(item)
+        except ValueError as exc:
+            raise ValueError(f'Invalid message at index {i}: {exc}') from None
+
+
+def untag_broker_message(
+    data: dict | str | bytes, codec: Codec | None = None
+) -> tuple:
+    if is_compressed(data):
+        data = decompress(data)
+    if is_binary_envelope(data):
+        return unpack_envelope(data, codec)
     if isinstance(data, (str, bytes)):
-        data: dict = json.loads(data)
+        data: dict = get_codec(codec).loads(data)
     return data.pop('type'), data.pop('topic'), data.pop('conn_id'), data
 
 
 class Message:
+    '''
+    The envelope of a message (`typ`, `topic`, `conn_id` and the
+    `origin` node) is kept apart from its payload, `data`, that is
+    never modified: brokers encode the envelope and the payload
+    without merging them into a new dict (see `pack_envelope`).
+    The payload must be a dict, as the envelope fields are encoded
+    as keys of the same JSON object.
+    `__serialize__` returns the merged dict for the callers that
+    need one, at the cost of copying the payload.
+    '''
+
+    __slots__ = ('typ', 'topic', 'conn_id', 'data', 'origin')
+
     def __init__(
         self,
         *,
-        data: Any,
+        data: dict,
         typ: str,
         topic: str | None = None,
         conn_id: str | list[str] | None = None,
+        origin: str | None = None,
     ) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(
+                f'Message data must be a dict, not {type(data).__name__}'
+            )
         self.typ = typ
         self.topic = topic
         self.conn_id = conn_id
         self.data = data
+        self.origin = origin
 
     @classmethod
     def from_client_message(cls, *, data: dict) -> 'Message':
+        # clients can't pass their messages off as a node's echo
+        data.pop(ORIGIN_KEY, None)
         return cls(
             data=data,
             typ=data.pop('type', None),
@@ -88,8 +126,23 @@ class Message:
             conn_id=data.pop('conn_id', None),
         )
 
+    @classmethod
+    def from_broker_message(
+        cls, data: dict | str | bytes, codec: Codec | None = None
+    ) -> 'Message':
+        typ, topic, conn_id, data = untag_broker_message(data, codec)
+        origin = data.pop(ORIGIN_KEY, None) if isinstance(data, dict) else None
+        return cls(
+            data=data, typ=typ, topic=topic, conn_id=conn_id, origin=origin
+        )
+
     def __serialize__(self) -> dict[str, Any]:
-        self.data['type'] = self.typ
-        self.data['topic'] = self.topic
-        self.data['conn_id'] = self.conn_id
-        return self.data
+        serialized = {
+            **self.data,
+            'type': self.typ,
+            'topic': self.topic,
+            'conn_id': self.conn_id,
+        }
+        if self.origin is not None:
+            serialized[ORIGIN_KEY] = self.origin
+        return serialized
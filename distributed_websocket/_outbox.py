@@ -0,0 +1,116 @@
+__all__ = ('BACKPRESSURE_POLICIES', 'Outbox')
+
+import asyncio
+from collections import deque
+from typing import Any
+
+BACKPRESSURE_POLICIES = ('drop_oldest', 'drop_newest', 'conflate', 'close')
+
+
+class Outbox:
+    '''
+    Queue of encoded frames waiting to be written to a socket,
+    bounded both in number of frames and in their total length.
+    When a new frame does not fit, `policy` decides what to do:
+
+    * `drop_oldest`: drop queued frames, oldest first, to make room.
+    * `drop_newest`: drop the new frame.
+    * `conflate`: replace the queued frame with the same `key`,
+      falling back to `drop_oldest` if there is none.
+    * `close`: drop the new frame and let the owner close the socket.
+
+    Frames put with `conflate` replace the queued frame with the
+    same `key` even when there is room, counted in `conflated`.
+    '''
+
+    def __init__(
+        self,
+        max_size: int,
+        max_bytes: int | None = None,
+        policy: str = 'drop_newest',
+    ) -> None:
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f'Invalid backpressure policy: {policy}')
+        self.max_size: int = max_size
+        self.max_bytes: int | None = max_bytes
+        self.policy: str = policy
+        self.nbytes: int = 0
+        self.conflated: int = 0
+        # entries are [key, frame] lists, so that conflation can
+        # swap the frame in place keeping the queue order
+        self._entries: deque[list] = deque()
+        self._keys: dict[Any, list] = {}
+        self._ready: asyncio.Event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _overflows(self, count: int, size: int) -> bool:
+        return len(self._entries) + count > self.max_size or (
+            self.max_bytes is not None and self.nbytes + size > self.max_bytes
+        )
+
+    def _append(self, frame: str | bytes, key: Any) -> None:
+        entry = [key, frame]
+        self._entries.append(entry)
+        self.nbytes += len(frame)
+        if key is not None:
+            self._keys[key] = entry
+        self._ready.set()
+
+    def _popleft(self) -> list:
+        entry = self._entries.popleft()
+        self.nbytes -= len(entry[1])
+        if entry[0] is not None and self._keys.get(entry[0]) is entry:
+            del self._keys[entry[0]]
+        return entry
+
+    def _replace(self, entry: list, frame: str | bytes) -> None:
+        self.nbytes += len(frame) - len(entry[1])
+        entry[1] = frame
+
+    def put(
+        self, frame: str | bytes, key: Any = None, conflate: bool = False
+    ) -> str | None:
+        '''
+        Queue `frame`, returning the policy applied if it did not fit.
+        '''
+        size = len(frame)
+        entry = self._keys.get(key) if key is not None else None
+        if (
+            conflate
+            and entry is not None
+            and not self._overflows(0, size - len(entry[1]))
+        ):
+            self._replace(entry, frame)
+            self.conflated += 1
+            return None
+        if not self._overflows(1, size):
+            self._append(frame, key)
+            return None
+        if self.policy in ('drop_newest', 'close'):
+            return self.policy
+        if self.policy == 'conflate' and entry is not None:
+            self._replace(entry, frame)
+        else:
+            while self._entries and self._overflows(1, size):
+                self._popleft()
+            self._append(frame, key)
+        # a frame larger than `max_bytes` is still sent, on its own
+        while len(self._entries) > 1 and self._overflows(0, 0):
+            self._popleft()
+        return self.policy
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys.clear()
+        self.nbytes = 0
+
+    def get_nowait(self) -> str | bytes:
+        return self._popleft()[1]
+
+    async def get(self) -> str | bytes:
+        while not self._entries:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._popleft()[1]
@@ -0,0 +1,95 @@
+__all__ = ('BROKER_ROUTINGS', 'TopicRouter')
+
+from collections import Counter
+
+BROKER_ROUTINGS = ('global', 'topic')
+
+# characters with a special meaning in Redis glob-style patterns
+_GLOB_SPECIAL = frozenset('*?[]\\')
+
+
+def _escape_glob(text: str) -> str:
+    return ''.join(
+        f'\\{char}' if char in _GLOB_SPECIAL else char for char in text
+    )
+
+
+def _literal_prefix(pattern: str) -> str:
+    # every topic matching `pattern` starts with the characters
+    # that come before its first wildcard
+    for i, char in enumerate(pattern):
+        if char in '+#':
+            return pattern[:i]
+    return pattern
+
+
+class TopicRouter:
+    '''
+    Derives the broker channel of a topic, `<broker_channel>:<prefix>`
+    where prefix is made of the first `depth` segments of the topic
+    (the whole topic if `depth` is `None`), and keeps track of the
+    channels needed to receive the topics matching a set of patterns.
+
+    A pattern whose first `depth` segments are literal needs a single
+    channel. Otherwise it needs a glob subscription on the channels
+    starting with its literal prefix, that may deliver more topics
+    than the pattern matches, to be filtered locally.
+    `channels` and `globs` never overlap, so that no message is
+    delivered twice.
+    '''
+
+    def __init__(self, broker_channel: str, depth: int | None = None) -> None:
+        if depth is not None and depth < 1:
+            raise ValueError('depth must be at least 1')
+        self.broker_channel: str = broker_channel
+        self.depth: int | None = depth
+        self._channels: Counter[str] = Counter()
+        self._prefixes: Counter[str] = Counter()
+
+    def _glob_prefixes(self) -> list[str]:
+        # drop the prefixes already covered by a shorter one
+        prefixes: list[str] = []
+        for prefix in sorted(self._prefixes):
+            if not prefixes or not prefix.startswith(prefixes[-1]):
+                prefixes.append(prefix)
+        return prefixes
+
+    @property
+    def channels(self) -> set[str]:
+        prefixes = tuple(self._glob_prefixes())
+        return {
+            channel
+            for channel in self._channels
+            if not channel.startswith(prefixes)
+        }
+
+    @property
+    def globs(self) -> set[str]:
+        return {_escape_glob(prefix) + '*' for prefix in self._glob_prefixes()}
+
+    def _prefix(self, topic: str) -> str:
+        if self.depth is None:
+            return topic
+        return '/'.join(topic.split('/')[: self.depth])
+
+    def channel(self, topic: str) -> str:
+        return f'{self.broker_channel}:{self._prefix(topic)}'
+
+    def _subscription(self, pattern: str) -> tuple[str, bool]:
+        prefix = _literal_prefix(pattern)
+        if prefix == pattern or (
+            self.depth is not None and prefix.count('/') >= self.depth
+        ):
+            return self.channel(prefix), False
+        return f'{self.broker_channel}:{prefix}', True
+
+    def add(self, pattern: str) -> None:
+        name, is_prefix = self._subscription(pattern)
+        (self._prefixes if is_prefix else self._channels)[name] += 1
+
+    def discard(self, pattern: str) -> None:
+        name, is_prefix = self._subscription(pattern)
+        counter = self._prefixes if is_prefix else self._channels
+        counter[name] -= 1
+        if counter[name] <= 0:
+            del counter[name]
@@ -3,10 +3,14 @@ __all__ = (
     'subscribe',
     'unsubscribe',
     'handle_subscription_message',
+    'SubscriptionIndex',
 )
 
+from collections.abc import Callable, Iterable
+
 from ._connection import Connection
 from ._exceptions import InvalidSubscriptionMessage
+from ._matching import PatternTrie
 from ._message import Message
 
 
@@ -50,3 +54,143 @@ def handle_subscription_message(
         subscribe(connection, message)
     else:
         unsubscribe(connection, message)
+
+
+class TopicSet(set):
+    '''
+    The `set` of patterns stored in `Connection.topics` once the
+    connection has been added to a `SubscriptionIndex`.
+    Any change to it, either made by `subscribe`/`unsubscribe`
+    or directly on `connection.topics`, is mirrored in the index.
+    '''
+
+    def __init__(
+        self,
+        patterns: Iterable[str],
+        index: 'SubscriptionIndex',
+        connection: Connection,
+    ) -> None:
+        super().__init__(patterns)
+        self._index = index
+        self._connection = connection
+
+    def add(self, pattern: str) -> None:
+        if pattern not in self:
+            super().add(pattern)
+            self._index._add(self._connection, pattern)
+
+    def discard(self, pattern: str) -> None:
+        if pattern in self:
+            super().discard(pattern)
+            self._index._discard(self._connection, pattern)
+
+    def remove(self, pattern: str) -> None:
+        if pattern not in self:
+            raise KeyError(pattern)
+        self.discard(pattern)
+
+    def pop(self) -> str:
+        pattern = super().pop()
+        self._index._discard(self._connection, pattern)
+        return pattern
+
+    def clear(self) -> None:
+        for pattern in list(self):
+            self.discard(pattern)
+
+    def update(self, *others: Iterable[str]) -> None:
+        for other in others:
+            for pattern in other:
+                self.add(pattern)
+
+    def difference_update(self, *others: Iterable[str]) -> None:
+        for other in others:
+            for pattern in list(other):
+                self.discard(pattern)
+
+    def intersection_update(self, *others: Iterable[str]) -> None:
+        keep = set(self).intersection(*others)
+        for pattern in set(self) - keep:
+            self.discard(pattern)
+
+    def symmetric_difference_update(self, other: Iterable[str]) -> None:
+        for pattern in set(other):
+            if pattern in self:
+                self.discard(pattern)
+            else:
+                self.add(pattern)
+
+    def __ior__(self, other: Iterable[str]) -> 'TopicSet':
+        self.update(other)
+        return self
+
+    def __isub__(self, other: Iterable[str]) -> 'TopicSet':
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other: Iterable[str]) -> 'TopicSet':
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other: Iterable[str]) -> 'TopicSet':
+        self.symmetric_difference_update(other)
+        return self
+
+
+class SubscriptionIndex:
+    '''
+    Maps subscription patterns to the connections that hold them,
+    so that finding the recipients of a topic costs a walk of
+    the pattern trie instead of a scan of every connection.
+    `on_pattern_added` and `on_pattern_removed` are called with
+    a pattern when its first subscriber comes and its last leaves.
+    '''
+
+    def __init__(
+        self,
+        on_pattern_added: Callable[[str], None] | None = None,
+        on_pattern_removed: Callable[[str], None] | None = None,
+    ) -> None:
+        self._trie: PatternTrie = PatternTrie()
+        self._subscribers: dict[str, set[Connection]] = {}
+        self._on_pattern_added = on_pattern_added
+        self._on_pattern_removed = on_pattern_removed
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def _add(self, connection: Connection, pattern: str) -> None:
+        subscribers = self._subscribers.get(pattern)
+        if subscribers is None:
+            subscribers = self._subscribers[pattern] = set()
+            self._trie.add(pattern)
+            if self._on_pattern_added is not None:
+                self._on_pattern_added(pattern)
+        subscribers.add(connection)
+
+    def _discard(self, connection: Connection, pattern: str) -> None:
+        subscribers = self._subscribers.get(pattern)
+        if subscribers is None:
+            return
+        subscribers.discard(connection)
+        if not subscribers:
+            del self._subscribers[pattern]
+            self._trie.discard(pattern)
+            if self._on_pattern_removed is not None:
+                self._on_pattern_removed(pattern)
+
+    def add_connection(self, connection: Connection) -> None:
+        connection.topics = TopicSet(connection.topics, self, connection)
+        for pattern in connection.topics:
+            self._add(connection, pattern)
+
+    def remove_connection(self, connection: Connection) -> None:
+        for pattern in connection.topics:
+            self._discard(connection, pattern)
+        connection.topics = set(connection.topics)
+
+    def match(self, topic: str) -> set[Connection]:
+        connections: set[Connection] = set()
+        for pattern in self._trie.match(topic):
+            connections |= self._subscribers[pattern]
+        return connections
@@ -1,52 +1,144 @@
 import asyncio
-from collections.abc import Callable, Coroutine, Iterator
+import logging
+import uuid
+from collections import Counter
+from collections.abc import Callable, Coroutine, Hashable, Iterable, Iterator
 from typing import Any, TypeVar
 
 from fastapi import WebSocket, status
 
 from ._broker import create_broker
+from ._codec import Codec, get_codec
+from ._compression import FrameCompressor
+from ._connect import handle_connect_message, is_connect_message
 from ._connection import Connection
 from ._decorators import ahandle
+from ._dispatch import Dispatcher
 from ._exception_handlers import send_error_message
 from ._exceptions import WebSocketException
-from ._matching import matches
+from ._matching import PatternTrie
 from ._message import Message
+from ._routing import BROKER_ROUTINGS, TopicRouter
 from ._subscriptions import (
+    SubscriptionIndex,
     handle_subscription_message,
     is_subscription_message,
 )
 from ._types import BrokerT
-from .utils import clear_task, is_valid_broker, serialize
+from .utils import clear_task, is_valid_broker
 
 T = TypeVar('T')
 
+logger = logging.getLogger(__name__)
+
 
 def _init_broker(
-    url: str, broker_class: Any | None = None, **kwargs
+    url: str,
+    broker_class: Any | None = None,
+    codec: Codec | None = None,
+    **kwargs,
 ) -> BrokerT:
     if broker_class:
         assert is_valid_broker(
             broker_class
         ), 'Invalid broker class. Use distributed_websocket.utils.is_valid_broker to check if your broker_class is valid.'  # noqa: E501
         return broker_class(**kwargs)
-    return create_broker(url, **kwargs)
+    return create_broker(url, codec=codec, **kwargs)
 
 
 class WebSocketManager:
+    broker_sync_retry_delay: float = 1.0
+
     def __init__(
         self,
         broker_channel,
         broker_url: str | None = None,
         broker_class: Any | None = None,
+        connection_queue_size: int = 1024,
+        connection_queue_bytes: int | None = None,
+        backpressure_policy: str = 'drop_newest',
+        backpressure_close_code: int = status.WS_1013_TRY_AGAIN_LATER,
+        on_backpressure: Callable[[Connection, str], Any] | None = None,
+        codec: Codec | str | None = None,
+        broker_routing: str = 'global',
+        broker_topic_depth: int | None = None,
+        direct_routing: bool = False,
+        node_id: str | None = None,
+        registry_ttl: float = 60.0,
+        local_delivery: bool = False,
+        dispatch_concurrency: int | None = 1024,
+        broker_batch_size: int = 100,
+        conflate_topics: Iterable[str] = (),
+        conflation_key: str | None = None,
+        max_batch_size: int = 100,
+        max_batch_delay: float = 0.005,
+        frame_compression_threshold: int | None = 1024,
+        frame_compression_level: int = 6,
         **kwargs,
     ) -> None:
+        if broker_routing not in BROKER_ROUTINGS:
+            raise ValueError(f'Invalid broker routing: {broker_routing}')
+        if broker_batch_size < 1:
+            raise ValueError(f'Invalid broker batch size: {broker_batch_size}')
+        self.codec: Codec = get_codec(codec)
         self.active_connections: list[Connection] = []
-        self._send_tasks: list[asyncio.Task] = []
+        self._router: TopicRouter | None = None
+        if broker_routing == 'topic':
+            self._router = TopicRouter(broker_channel, broker_topic_depth)
+            self._subscription_index = SubscriptionIndex(
+                self._router_add, self._router_discard
+            )
+        else:
+            self._subscription_index = SubscriptionIndex()
+        self._broker_channels: set[str] = set()
+        self._broker_globs: set[str] = set()
+        self._broker_sync_task: asyncio.Task | None = None
+        self._broker_sync_pending: bool = False
+        self._connections_by_id: dict[str, set[Connection]] = {}
+        self.dispatcher: Dispatcher = Dispatcher(dispatch_concurrency)
+        self.broker_batch_size: int = broker_batch_size
+        self._conflated_topics: PatternTrie = PatternTrie()
+        for pattern in conflate_topics:
+            self._conflated_topics.add(pattern)
+        self.conflation_key: str | None = conflation_key
+        self.max_batch_size: int = max_batch_size
+        self.max_batch_delay: float = max_batch_delay
+        self.frame_compression_threshold: int | None = (
+            frame_compression_threshold
+        )
+        self._frame_compressor: FrameCompressor = FrameCompressor(
+            frame_compression_level
+        )
         self._main_task: asyncio.Task | None = None
         self.broker: BrokerT | None = _init_broker(
-            broker_url, broker_class, **kwargs
+            broker_url, broker_class, self.codec, **kwargs
         )
         self.broker_channel: str = broker_channel
+        self.broker_routing: str = broker_routing
+        if self._router is not None and not getattr(
+            self.broker, 'supports_psubscribe', False
+        ):
+            raise ValueError('Topic routing requires a broker with psubscribe')
+        if direct_routing and not getattr(
+            self.broker, 'supports_conn_id_registry', False
+        ):
+            raise ValueError(
+                'Direct routing requires a broker with a conn_id registry'
+            )
+        self.direct_routing: bool = direct_routing
+        self.node_id: str = node_id or uuid.uuid4().hex
+        self.inbox_channel: str = self._get_inbox_channel(self.node_id)
+        self.registry_ttl: float = registry_ttl
+        self.local_delivery: bool = local_delivery
+        self._registry_changes: dict[str, bool] = {}
+        self._registry_task: asyncio.Task | None = None
+        self._registry_refresh_task: asyncio.Task | None = None
+        self.connection_queue_size: int = connection_queue_size
+        self.connection_queue_bytes: int | None = connection_queue_bytes
+        self.backpressure_policy: str = backpressure_policy
+        self.backpressure_close_code: int = backpressure_close_code
+        self.backpressure_events: Counter[str] = Counter()
+        self._on_backpressure = on_backpressure
 
     async def __aenter__(self) -> 'WebSocketManager':
         await self.startup()
@@ -60,18 +152,173 @@ class WebSocketManager:
 
     async def _connect(self, connection: Connection) -> None:
         await connection.accept()
+        connection.start_writer()
         self.active_connections.append(connection)
+        self._subscription_index.add_connection(connection)
+        self._add_conn_id(connection)
 
     def _disconnect(self, connection: Connection) -> None:
-        self.active_connections.remove(connection)
+        # also called by a connection whose socket is gone, or that the
+        # `close` backpressure policy closed
+        connection.stop_writer()
+        try:
+            self.active_connections.remove(connection)
+        except ValueError:
+            return
+        self._subscription_index.remove_connection(connection)
+        self._remove_conn_id(connection)
+
+    def _add_conn_id(self, connection: Connection) -> None:
+        connections = self._connections_by_id.setdefault(connection.id, set())
+        if not connections and self.direct_routing:
+            self._schedule_registry_update(connection.id, True)
+        connections.add(connection)
+
+    def _remove_conn_id(self, connection: Connection) -> bool:
+        connections = self._connections_by_id.get(connection.id)
+        if connections is None or connection not in connections:
+            return False
+        connections.remove(connection)
+        if not connections:
+            del self._connections_by_id[connection.id]
+            if self.direct_routing:
+                self._schedule_registry_update(connection.id, False)
+        return True
+
+    def _get_inbox_channel(self, node_id: str) -> str:
+        return f'{self.broker_channel}@{node_id}'
+
+    def _schedule_registry_update(self, conn_id: str, register: bool) -> None:
+        self._registry_changes[conn_id] = register
+        self._start_registry_update()
+
+    def _start_registry_update(self) -> None:
+        if self._registry_task is None or self._registry_task.done():
+            self._registry_task = asyncio.create_task(self._update_registry())
+
+    async def _update_registry(self) -> None:
+        '''
+        Register the conn_ids that gained their first local connection
+        and unregister those that lost their last one, in the order
+        the changes were made. A single task does it.
+        If the broker fails, the changes not made yet go back to the
+        pending ones, for the next update or refresh to retry them.
+        '''
+        while self._registry_changes:
+            changes, self._registry_changes = self._registry_changes, {}
+            registered = [c for c, register in changes.items() if register]
+            unregistered = [
+                c for c, register in changes.items() if not register
+            ]
+            try:
+                if registered:
+                    await self.broker.register_conn_ids(
+                        registered, self.node_id, self.registry_ttl
+                    )
+                    registered = []
+                if unregistered:
+                    await self.broker.unregister_conn_ids(
+                        unregistered, self.node_id
+                    )
+            except Exception:
+                logger.exception('Failed to update the conn_id registry')
+                failed = dict.fromkeys(registered, True)
+                failed.update(dict.fromkeys(unregistered, False))
+                # changes made in the meantime are newer
+                self._registry_changes = failed | self._registry_changes
+                return
+
+    async def _refresh_registry(self) -> None:
+        while True:
+            await asyncio.sleep(self.registry_ttl / 3)
+            try:
+                if self._connections_by_id:
+                    await self.broker.register_conn_ids(
+                        list(self._connections_by_id),
+                        self.node_id,
+                        self.registry_ttl,
+                    )
+            except Exception:
+                logger.exception('Failed to refresh the conn_id registry')
+            if self._registry_changes:
+                self._start_registry_update()
 
     async def new_connection(
-        self, websocket: WebSocket, conn_id: str, topic: str | None = None
+        self,
+        websocket: WebSocket,
+        conn_id: str,
+        topic: str | None = None,
+        conflate: bool = False,
     ) -> Connection:
-        connection = Connection(websocket, conn_id, topic)
+        connection = Connection(
+            websocket,
+            conn_id,
+            topic,
+            max_queue_size=self.connection_queue_size,
+            max_queue_bytes=self.connection_queue_bytes,
+            backpressure_policy=self.backpressure_policy,
+            backpressure_close_code=self.backpressure_close_code,
+            on_backpressure=self._backpressure_event,
+            on_close=self._disconnect,
+            codec=self.codec,
+            conflate=conflate,
+        )
         await self._connect(connection)
         return connection
 
+    def _router_add(self, pattern: str) -> None:
+        self._router.add(pattern)
+        self._schedule_broker_sync()
+
+    def _router_discard(self, pattern: str) -> None:
+        self._router.discard(pattern)
+        self._schedule_broker_sync()
+
+    def _schedule_broker_sync(self) -> None:
+        self._broker_sync_pending = True
+        if self._broker_sync_task is None or self._broker_sync_task.done():
+            self._broker_sync_task = asyncio.create_task(
+                self._sync_broker_subscriptions()
+            )
+
+    async def _sync_broker_subscriptions(self) -> None:
+        '''
+        Bring the broker subscriptions in line with the channels
+        needed by the local subscribers. A single task does it,
+        looping while subscriptions keep changing.
+        If the broker fails, the sync is retried after
+        `broker_sync_retry_delay` seconds.
+        '''
+        while self._broker_sync_pending:
+            self._broker_sync_pending = False
+            try:
+                await self._sync_broker_channels()
+            except Exception:
+                logger.exception('Failed to sync the broker subscriptions')
+                self._broker_sync_pending = True
+                await asyncio.sleep(self.broker_sync_retry_delay)
+
+    async def _sync_broker_channels(self) -> None:
+        # the broker subscriptions are recorded once made
+        channels, globs = self._router.channels, self._router.globs
+        for channel in self._broker_channels - channels:
+            await self.broker.unsubscribe(channel)
+            self._broker_channels.discard(channel)
+        for glob in self._broker_globs - globs:
+            await self.broker.punsubscribe(glob)
+            self._broker_globs.discard(glob)
+        for glob in globs - self._broker_globs:
+            await self.broker.psubscribe(glob)
+            self._broker_globs.add(glob)
+        for channel in channels - self._broker_channels:
+            await self.broker.subscribe(channel)
+            self._broker_channels.add(channel)
+
+    def _backpressure_event(self, connection: Connection, event: str) -> None:
+        self.backpressure_events[event] += 1
+        if self._on_backpressure is not None:
+            self._on_backpressure(connection, event)
+
     async def close_connection(
         self, connection: Connection, code: int = status.WS_1000_NORMAL_CLOSURE
     ) -> None:
@@ -88,48 +335,75 @@ class WebSocketManager:
 
     async def _set_conn_id(self, connection: Connection, conn_id: str) -> None:
         connection.id = conn_id
-        await connection.send_json({'type': 'set_conn_id', 'conn_id': conn_id})
+        connection.enqueue({'type': 'set_conn_id', 'conn_id': conn_id})
 
     def set_conn_id(self, connection: Connection, conn_id: str) -> None:
-        self._send_tasks.append(
-            asyncio.create_task(self._set_conn_id(connection, conn_id))
-        )
+        if self._remove_conn_id(connection):
+            connection.id = conn_id
+            self._add_conn_id(connection)
+        self.dispatcher.submit(self._set_conn_id(connection, conn_id))
+
+    def _encode(self, message: Message) -> str:
+        return self.codec.dumps(message.data)
+
+    def _get_conflation_key(self, message: Message) -> Any:
+        '''
+        The topic of the message, along with the value of its
+        `conflation_key` field if it has one.
+        '''
+        if self.conflation_key is None or not isinstance(message.data, dict):
+            return message.topic
+        value = message.data.get(self.conflation_key)
+        if value is None or not isinstance(value, Hashable):
+            return message.topic
+        return (message.topic, value)
+
+    def _enqueue(
+        self, connections: Iterable[Connection], message: Message
+    ) -> None:
+        frame = None
+        for connection in connections:
+            if frame is None:
+                frame = self._encode(message)
+                key = self._get_conflation_key(message)
+                conflate = message.topic is not None and bool(
+                    self._conflated_topics.match(message.topic)
+                )
+            connection.enqueue_frame(frame, key, conflate)
 
     async def _send(self, message: Message) -> None:
-        for connection in self.active_connections:
-            if matches(message.topic, connection.topics):
-                await connection.send_json(message.data)
+        self._enqueue(self._subscription_index.match(message.topic), message)
 
     def send(self, message: Message) -> None:
-        self._send_tasks.append(asyncio.create_task(self._send(message)))
+        self.dispatcher.submit(self._send(message))
 
     async def _broadcast(self, message: Message) -> None:
-        for connection in self.active_connections:
-            await connection.send_json(message.data)
+        self._enqueue(self.active_connections, message)
 
     def broadcast(self, message: Message) -> None:
-        self._send_tasks.append(asyncio.create_task(self._broadcast(message)))
+        self.dispatcher.submit(self._broadcast(message))
+
+    def _get_connections_by_id(self, conn_id: str) -> Iterable[Connection]:
+        return self._connections_by_id.get(conn_id, ())
 
     async def _send_by_conn_id(self, message: Message) -> None:
-        for connection in self.active_connections:
-            if connection.id == message.conn_id:
-                await connection.send_json(message.data)
-                break
+        self._enqueue(self._get_connections_by_id(message.conn_id), message)
 
     async def _send_multi_by_conn_id(self, message: Message) -> None:
-        for connection in self.active_connections:
-            if connection.id in message.conn_id:
-                await connection.send_json(message.data)
+        self._enqueue(
+            (
+                connection
+                for conn_id in dict.fromkeys(message.conn_id)
+                for connection in self._get_connections_by_id(conn_id)
+            ),
+            message,
+        )
 
     def send_by_conn_id(self, message: Message) -> None:
         if isinstance(message.conn_id, list):
-            self._send_tasks.append(
-                asyncio.create_task(self._send_multi_by_conn_id(message))
-            )
+            self.dispatcher.submit(self._send_multi_by_conn_id(message))
         else:
-            self._send_tasks.append(
-                asyncio.create_task(self._send_by_conn_id(message))
-            )
+            self.dispatcher.submit(self._send_by_conn_id(message))
 
     def _get_outgoing_message_handler(
         self, message: Message
@@ -139,36 +413,169 @@ class WebSocketManager:
     def send_msg(self, message: Message) -> None:
         self._get_outgoing_message_handler(message)(message)
 
-    async def _publish_to_broker(self, message: Any) -> None:
-        await self.broker.publish(self.broker_channel, message)
-
-    @ahandle(WebSocketException, send_error_message)
-    async def receive(self, connection: Connection, message: Message) -> None:
-        if is_subscription_message(message):
-            handle_subscription_message(connection, message)
+    async def _deliver(self, message: Message) -> None:
+        '''
+        Deliver a message to the local recipients in the calling task.
+        '''
+        if message.typ == 'broadcast':
+            await self._broadcast(message)
+        elif message.typ == 'send_by_conn_id':
+            if isinstance(message.conn_id, list):
+                await self._send_multi_by_conn_id(message)
+            else:
+                await self._send_by_conn_id(message)
         else:
-            await self._publish_to_broker(serialize(message))
+            await self._send(message)
+
+    def _tag_origin(self, message: Message) -> Message:
+        message.origin = self.node_id if self.local_delivery else None
+        return message
+
+    def _is_echo(self, message: Message) -> bool:
+        return self.local_delivery and message.origin == self.node_id
+
+    def _get_broker_channel(self, message: Message) -> str:
+        if (
+            self._router is not None
+            and message.typ == 'send'
+            and message.topic is not None
+        ):
+            return self._router.channel(message.topic)
+        return self.broker_channel
+
+    async def _publish_to_broker(
+        self, message: Any, channel: str | None = None
+    ) -> None:
+        await self.broker.publish(channel or self.broker_channel, message)
+
+    async def _publish_many(self, messages: list[tuple[str, Any]]) -> None:
+        if len(messages) == 1:
+            channel, data = messages[0]
+            await self._publish_to_broker(data, channel)
+        elif messages and hasattr(self.broker, 'publish_many'):
+            await self.broker.publish_many(messages)
+        else:
+            for channel, data in messages:
+                await self._publish_to_broker(data, channel)
+
+    async def _publish_to_nodes(self, message: Message) -> None:
+        '''
+        Publish a `send_by_conn_id` message only to the inboxes of
+        the nodes holding its recipients.
+        '''
+        conn_ids = (
+            message.conn_id
+            if isinstance(message.conn_id, list)
+            else [message.conn_id]
+        )
+        located = await self.broker.locate_conn_ids(dict.fromkeys(conn_ids))
+        nodes = set().union(*located.values())
+        if self.local_delivery:
+            nodes.discard(self.node_id)
+        message = self._tag_origin(message)
+        await asyncio.gather(
+            *(
+                self._publish_to_broker(
+                    message, self._get_inbox_channel(node_id)
+                )
+                for node_id in sorted(nodes)
+            )
+        )
 
-    async def _next_broker_message(self) -> Message:
-        return await self.broker.get_message()
+    @ahandle(WebSocketException, send_error_message)
+    async def receive(
+        self, connection: Connection, message: Message | list[Message] | None
+    ) -> None:
+        '''
+        Handle a message, or a batch of messages, from a client.
+        The messages of a batch that go to the broker are published
+        all at once, after the others have been handled. `None`,
+        returned by the connection for invalid messages, is ignored.
+        '''
+        if message is None:
+            return
+        messages = message if isinstance(message, list) else [message]
+        published = []
+        try:
+            for message in messages:
+                if is_subscription_message(message):
+                    handle_subscription_message(connection, message)
+                    continue
+                if is_connect_message(message):
+                    handle_connect_message(
+                        connection,
+                        message,
+                        self.max_batch_size,
+                        self.max_batch_delay,
+                        self.frame_compression_threshold,
+                        self._frame_compressor,
+                    )
+                    continue
+                if self.local_delivery:
+                    await self._deliver(message)
+                if self.direct_routing and message.typ == 'send_by_conn_id':
+                    await self._publish_to_nodes(message)
+                else:
+                    published.append(
+                        (
+                            self._get_broker_channel(message),
+                            self._tag_origin(message),
+                        )
+                    )
+        finally:
+            # an invalid subscription stops the batch, not what came before
+            await self._publish_many(published)
+
+    async def _next_broker_messages(self) -> list[Message]:
+        if hasattr(self.broker, 'get_messages'):
+            return await self.broker.get_messages(self.broker_batch_size)
+        message = await self.broker.get_message()
+        return [] if message is None else [message]
+
+    async def _deliver_batch(self, messages: list[Message]) -> None:
+        for message in messages:
+            await self._deliver(message)
 
     async def _broker_listener(self) -> None:
+        '''
+        Drain the broker in batches of up to `broker_batch_size`
+        messages, each delivered by a single task: frames for the
+        same connection are queued together, and its writer sends
+        them all when it next runs.
+        '''
         while True:
-            message = await self._next_broker_message()
-            if message is not None:
-                self.send_msg(message)
+            messages = [
+                message
+                for message in await self._next_broker_messages()
+                if not self._is_echo(message)
+            ]
+            if messages:
+                self.dispatcher.submit(self._deliver_batch(messages))
 
     async def startup(self) -> None:
         await self.broker.connect()
         await self.broker.subscribe(self.broker_channel)
+        if self.direct_routing:
+            await self.broker.subscribe(self.inbox_channel)
+            self._registry_refresh_task = asyncio.create_task(
+                self._refresh_registry()
+            )
         self._main_task = asyncio.create_task(self._broker_listener())
 
     async def shutdown(self) -> None:
-        for task in self._send_tasks:
-            clear_task(task)
-        for connection in self.active_connections:
+        self.dispatcher.cancel()
+        # closing a connection removes it from active_connections
+        for connection in list(self.active_connections):
             await self.close_connection(
                 connection, code=status.WS_1012_SERVICE_RESTART
             )
         clear_task(self._main_task)
+        if self._registry_refresh_task is not None:
+            clear_task(self._registry_refresh_task)
+        if self._registry_task is not None and not self._registry_task.done():
+            # let this node unregister its connections
+            await asyncio.wait((self._registry_task,))
+        if self._broker_sync_task is not None:
+            # its errors are logged, not raised
+            self._broker_sync_task.cancel()
         await self.broker.disconnect()
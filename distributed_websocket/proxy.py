@@ -21,14 +21,23 @@ async def _reverse(
 
 
 class WebSocketProxy:
-    def __init__(self, client: WebSocket, server_endpoint: str) -> None:
+    def __init__(
+        self,
+        client: WebSocket,
+        server_endpoint: str,
+        compression: str | None = 'deflate',
+    ) -> None:
         self._client = client
         self._server_endpoint = server_endpoint
+        # per-message deflate on the connection to the server
+        self._compression = compression
         self._forward_task: asyncio.Task | None = None
         self._reverse_task: asyncio.Task | None = None
 
     async def __call__(self) -> None:
-        async with websockets.connect(self._server_endpoint) as target:
+        async with websockets.connect(
+            self._server_endpoint, compression=self._compression
+        ) as target:
             self._forward_task = asyncio.create_task(
                 _forward(self._client, target)
             )
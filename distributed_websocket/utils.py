@@ -9,9 +9,10 @@ __all__ = (
 
 import asyncio
 import inspect
-import json
 from typing import Any
 
+from ._codec import Codec, get_codec
+
 
 def clear_task(task: asyncio.Task) -> None:
     if task.done():
@@ -20,9 +21,9 @@ def clear_task(task: asyncio.Task) -> None:
         task.cancel()
 
 
-def is_valid_json(data: Any) -> bool:
+def is_valid_json(data: Any, codec: Codec | str | None = None) -> bool:
     try:
-        json.loads(data)
+        get_codec(codec).loads(data)
     except ValueError:
         return False
     return True
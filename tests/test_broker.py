@@ -1,6 +1,10 @@
+import asyncio
+import time
+
 import pytest
+from redis import exceptions as redis_exceptions
 
-from distributed_websocket._broker import create_broker
+from distributed_websocket._broker import _get_parser_class, create_broker
 from distributed_websocket._message import tag_client_message
 
 
@@ -14,3 +18,424 @@ async def test_inmemory_broker() -> None:
         )
         message = await broker.get_message()
         assert message.data == {'msg': 'hello'}
+
+
+@pytest.mark.asyncio
+async def test_inmemory_broker_codec() -> None:
+    pytest.importorskip('orjson')
+    async with create_broker('memory://', codec='orjson') as broker:
+        await broker.subscribe('test')
+        await broker.publish(
+            'test',
+            broker.codec.dumpb(
+                {'type': 'send', 'topic': 'a/b', 'conn_id': None, 'msg': 'hello'}
+            ),
+        )
+        message = await broker.get_message()
+        assert (message.typ, message.topic) == ('send', 'a/b')
+        assert message.data == {'msg': 'hello'}
+
+
+@pytest.mark.asyncio
+async def test_inmemory_broker_get_messages() -> None:
+    async with create_broker('memory://') as broker:
+        await broker.subscribe('test')
+        for i in range(5):
+            await broker.publish(
+                'test',
+                {'type': 'broadcast', 'topic': None, 'conn_id': None, 'i': i},
+            )
+        batch = await broker.get_messages(2)
+        assert [m.data for m in batch] == [{'i': 0}, {'i': 1}]
+        batch = await broker.get_messages(10)
+        assert [m.data for m in batch] == [{'i': 2}, {'i': 3}, {'i': 4}]
+
+
+@pytest.mark.asyncio
+async def test_inmemory_hub() -> None:
+    broker1 = create_broker('memory://hub')
+    broker2 = create_broker('memory://hub', max_queue_size=2)
+    other = create_broker('memory://')
+    assert broker1.hub is broker2.hub is not other.hub
+    await broker1.subscribe('a')
+    await broker2.subscribe('a')
+    await broker2.psubscribe('b*')
+    await other.subscribe('a')
+    for channel in ('a', 'b', 'c', 'a'):
+        await broker1.publish(
+            channel,
+            {
+                'type': 'broadcast',
+                'topic': None,
+                'conn_id': None,
+                'ch': channel,
+            },
+        )
+    # every subscriber gets its own copy
+    assert (await broker1.get_message()).data == {'ch': 'a'}
+    assert (await broker1.get_message()).data == {'ch': 'a'}
+    assert broker1._messages.empty()
+    # the oldest message is dropped from a full queue
+    assert broker2.dropped_messages == 1
+    assert (await broker2.get_message()).data == {'ch': 'b'}
+    assert (await broker2.get_message()).data == {'ch': 'a'}
+    assert other._messages.empty()
+    await broker2.disconnect()
+    assert broker2.hub._channels == {'a': {broker1}}
+    assert broker2.hub._pattern_subscribers == set()
+
+
+def test_inmemory_broker_ignores_other_options() -> None:
+    broker = create_broker(
+        'memory://', socket_keepalive=True, envelope='binary', max_queue_size=2
+    )
+    assert broker._messages.maxsize == 2
+
+
+@pytest.mark.asyncio
+async def test_inmemory_broker_psubscribe() -> None:
+    async with create_broker('memory://') as broker:
+        await broker.psubscribe('test:a/*')
+        await broker.psubscribe('test:\\[x?[yz]')
+        assert broker.has_subscribers('test:a/b/c')
+        assert broker.has_subscribers('test:[x1z')
+        assert not broker.has_subscribers('test:b')
+        assert not broker.has_subscribers('test:[x1a')
+        await broker.punsubscribe('test:a/*')
+        assert not broker.has_subscribers('test:a/b/c')
+
+
+@pytest.mark.asyncio
+async def test_inmemory_broker_psubscribe_classes() -> None:
+    async with create_broker('memory://') as broker:
+        await broker.psubscribe('test:[a-c]')
+        await broker.psubscribe('other:[^a]')
+        assert broker.has_subscribers('test:b')
+        assert not broker.has_subscribers('test:-')
+        assert not broker.has_subscribers('test:d')
+        assert broker.has_subscribers('other:b')
+        assert not broker.has_subscribers('other:a')
+
+
+@pytest.mark.asyncio
+async def test_inmemory_broker_registry() -> None:
+    async with create_broker('memory://') as broker:
+        await broker.register_conn_ids(['a', 'b'], 'node1', 60)
+        await broker.register_conn_ids(['b'], 'node2', 60)
+        await broker.register_conn_ids(['c'], 'node2', -1)
+        assert await broker.locate_conn_ids(['a', 'b', 'c', 'd']) == {
+            'a': {'node1'},
+            'b': {'node1', 'node2'},
+            'c': set(),
+            'd': set(),
+        }
+        await broker.unregister_conn_ids(['a', 'b'], 'node1')
+        assert await broker.locate_conn_ids(['a', 'b']) == {
+            'a': set(),
+            'b': {'node2'},
+        }
+
+
+@pytest.mark.asyncio
+async def test_redis_broker_get_message_timeout() -> None:
+    calls = []
+
+    async def get_message(**kwargs):
+        calls.append(kwargs)
+        return {
+            'type': 'message',
+            'channel': b'test',
+            'data': b'{"type": "send", "topic": "a", "conn_id": "c", "x": 1}',
+        }
+
+    broker = create_broker('redis://localhost:6379/0')
+    broker._pubsub.get_message = get_message
+    message = await broker.get_message()
+    assert message.data == {'x': 1}
+    await broker.get_message(timeout=None)
+    assert calls == [
+        {'ignore_subscribe_messages': True, 'timeout': 1.0},
+        {'ignore_subscribe_messages': True, 'timeout': None},
+    ]
+    broker = create_broker('redis://localhost:6379/0', get_message_timeout=5)
+    assert broker.get_message_timeout == 5
+
+
+class _Pipeline:
+    def __init__(self, batches: list, fail: bool = False) -> None:
+        self.batches = batches
+        self.fail = fail
+        self.commands = []
+
+    def publish(self, channel: str, message: bytes) -> None:
+        self.commands.append((channel, message))
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        if self.fail:
+            raise ConnectionError('connection lost')
+        self.batches.append(self.commands)
+        return [
+            ValueError('bad') if message == b'bad' else 1
+            for _, message in self.commands
+        ]
+
+
+@pytest.mark.asyncio
+async def test_redis_broker_publish_batch() -> None:
+    batches = []
+    broker = create_broker(
+        'redis://localhost:6379/0', publish_batch_size=3, publish_max_delay=1
+    )
+    broker._redis.pipeline = lambda transaction: _Pipeline(batches)
+    # a full batch is sent right away
+    await asyncio.wait_for(
+        asyncio.gather(*(broker.publish('c', b'%d' % i) for i in range(3))),
+        0.5,
+    )
+    assert batches == [[('c', b'0'), ('c', b'1'), ('c', b'2')]]
+    # otherwise after the max delay, each call getting its own error
+    broker.publish_max_delay = 0.01
+    results = await asyncio.gather(
+        broker.publish('c', b'ok'),
+        broker.publish('c', b'bad'),
+        return_exceptions=True,
+    )
+    assert results[0] is None and isinstance(results[1], ValueError)
+    assert batches[1] == [('c', b'ok'), ('c', b'bad')]
+    broker._redis.pipeline = lambda transaction: _Pipeline(batches, True)
+    with pytest.raises(ConnectionError):
+        await broker.publish('c', b'lost')
+
+
+@pytest.mark.asyncio
+async def test_redis_broker_publish_many() -> None:
+    batches = []
+    broker = create_broker(
+        'redis://localhost:6379/0', publish_batch_size=1, envelope='binary'
+    )
+    broker._redis.pipeline = lambda transaction: _Pipeline(batches)
+    await broker.publish_many(
+        [
+            ('a', b'1'),
+            ('b', {'type': 'broadcast', 'topic': None, 'conn_id': None}),
+        ]
+    )
+    assert len(batches) == 1
+    assert batches[0][0] == ('a', b'1')
+    assert batches[0][1][0] == 'b'
+    assert batches[0][1][1].startswith(b'\xffDW')
+
+
+@pytest.mark.asyncio
+async def test_redis_broker_publish_unbatched() -> None:
+    published = []
+
+    async def publish(channel, message):
+        published.append((channel, message))
+
+    broker = create_broker('redis://localhost:6379/0', publish_batch_size=1)
+    broker._redis.publish = publish
+    await broker.publish('c', b'x')
+    assert published == [('c', b'x')]
+    with pytest.raises(ValueError):
+        create_broker('redis://localhost:6379/0', publish_batch_size=0)
+
+
+class _Streams:
+    def __init__(self) -> None:
+        self.streams = {}
+        self.reads = []
+
+    async def xadd(self, name, fields, maxlen=None, approximate=True):
+        stream = self.streams.setdefault(name, [])
+        entry_id = f'1-{len(stream)}'.encode()
+        stream.append((entry_id, {b'data': fields['data']}))
+        del stream[: -maxlen if maxlen else None]
+        return entry_id
+
+    async def xrevrange(self, name, count=None):
+        return self.streams.get(name, [])[::-1][:count]
+
+    def _after(self, name, last_id):
+        index = int(last_id.split(b'-')[1]) if last_id != '0-0' else -1
+        return [e for e in self.streams.get(name, []) if int(e[0][2:]) > index]
+
+    async def xread(self, streams, count=None, block=None):
+        self.reads.append((dict(streams), count, block))
+        response = []
+        for name, last_id in streams.items():
+            entries = self._after(name, last_id)[:count]
+            if entries:
+                response.append([name.encode(), entries])
+        return response
+
+
+@pytest.mark.asyncio
+async def test_redis_broker_get_messages() -> None:
+    calls = []
+    pending = [
+        f'{{"type": "send", "topic": "a", "conn_id": null, "i": {i}}}'.encode()
+        for i in range(5)
+    ]
+
+    async def get_message(**kwargs):
+        calls.append(kwargs['timeout'])
+        if pending:
+            return {'type': 'message', 'channel': b'a', 'data': pending.pop(0)}
+
+    broker = create_broker('redis://localhost:6379/0')
+    broker._pubsub.get_message = get_message
+    batch = await broker.get_messages(3)
+    assert [m.data for m in batch] == [{'i': 0}, {'i': 1}, {'i': 2}]
+    # waits for the first message only
+    assert calls == [1.0, 0, 0]
+    calls.clear()
+    batch = await broker.get_messages(10, timeout=None)
+    assert [m.data for m in batch] == [{'i': 3}, {'i': 4}]
+    assert calls == [None, 0, 0]
+
+
+@pytest.mark.asyncio
+async def test_redis_streams_broker() -> None:
+    streams = _Streams()
+    broker = create_broker(
+        'redis-streams://localhost:6379/0',
+        publish_batch_size=1,
+        maxlen=3,
+        read_count=2,
+    )
+    assert broker._redis.connection_pool.connection_kwargs['port'] == 6379
+    broker._redis = broker._subscriber = streams
+    # no subscriptions, nothing to read
+    assert await broker.get_message(timeout=0) is None
+
+    def message(i):
+        return {'type': 'send', 'topic': 'a/b', 'conn_id': None, 'i': i}
+
+    await broker.publish('test', message(0))
+    await broker.subscribe('test')
+    for i in range(1, 4):
+        await broker.publish('test', message(i))
+    # read in batches of `read_count`, from the last ID seen
+    received = [await broker.get_message() for _ in range(3)]
+    assert [m.data for m in received] == [{'i': 1}, {'i': 2}, {'i': 3}]
+    assert [read[0]['test'] for read in streams.reads] == [b'1-0', b'1-2']
+    assert streams.reads[0][1:] == (2, 1000)
+    assert len(streams.streams['test']) == 3
+    await broker.unsubscribe('test')
+    assert broker.last_ids == {}
+
+
+@pytest.mark.asyncio
+async def test_redis_streams_broker_get_messages() -> None:
+    streams = _Streams()
+    broker = create_broker(
+        'redis-streams://localhost:6379/0', publish_batch_size=1, read_count=2
+    )
+    broker._redis = broker._subscriber = streams
+    await broker.subscribe('test')
+    for i in range(3):
+        await broker.publish(
+            'test', {'type': 'send', 'topic': 'a/b', 'conn_id': None, 'i': i}
+        )
+    # up to `read_count` entries per read
+    batch = await broker.get_messages(10)
+    assert [m.data for m in batch] == [{'i': 0}, {'i': 1}]
+    batch = await broker.get_messages(10)
+    assert [m.data for m in batch] == [{'i': 2}]
+    assert await broker.get_messages(10, timeout=0) == []
+
+
+@pytest.mark.asyncio
+async def test_redis_streams_broker_reconnect() -> None:
+    streams = _Streams()
+    broker = create_broker(
+        'redis-streams://localhost:6379/0',
+        publish_batch_size=1,
+        retry_delay=0.01,
+    )
+    broker._redis = broker._subscriber = streams
+    # nothing subscribed: wait for a subscription instead of spinning
+    waiter = asyncio.create_task(broker.get_message(timeout=None))
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    await broker.subscribe('test')
+    assert await asyncio.wait_for(waiter, 1) is None
+    await broker.publish(
+        'test', {'type': 'send', 'topic': 'a/b', 'conn_id': None, 'i': 0}
+    )
+    assert (await broker.get_message()).data == {'i': 0}
+    xread = streams.xread
+    failures = [
+        redis_exceptions.ConnectionError('lost'),
+        redis_exceptions.TimeoutError('lost'),
+    ]
+
+    async def flaky_xread(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return await xread(*args, **kwargs)
+
+    streams.xread = flaky_xread
+    await broker.publish(
+        'test', {'type': 'send', 'topic': 'a/b', 'conn_id': None, 'i': 1}
+    )
+    assert await broker.get_message() is None
+    assert await broker.get_message() is None
+    assert broker._backoff == 0.02
+    # resumes from the last delivered entry
+    assert (await broker.get_message()).data == {'i': 1}
+    assert broker._backoff == 0.0
+
+
+@pytest.mark.asyncio
+async def test_redis_broker_locate_conn_ids() -> None:
+    expires = str(time.time() + 60)
+
+    class Pipeline:
+        def __init__(self):
+            self.keys = []
+
+        def hgetall(self, key):
+            self.keys.append(key)
+
+        async def execute(self):
+            # with and without `decode_responses=True`
+            return [{b'node1': expires.encode()}, {'node2': expires}]
+
+    class Client:
+        def pipeline(self, transaction=True):
+            return Pipeline()
+
+    broker = create_broker('redis://localhost:6379/0')
+    broker._redis = Client()
+    assert await broker.locate_conn_ids(['a', 'b']) == {
+        'a': {'node1'},
+        'b': {'node2'},
+    }
+
+
+def test_redis_broker_options() -> None:
+    broker = create_broker(
+        'redis://localhost:6379/0',
+        max_connections=10,
+        socket_keepalive=True,
+        health_check_interval=30,
+        parser='python',
+        socket_timeout=5,
+    )
+    assert broker._subscriber is not broker._redis
+    parser_class = _get_parser_class('python')
+    for client in (broker._redis, broker._subscriber):
+        pool = client.connection_pool
+        assert pool.max_connections == 10
+        assert pool.connection_kwargs['socket_keepalive'] is True
+        assert pool.connection_kwargs['health_check_interval'] == 30
+        assert pool.connection_kwargs['socket_timeout'] == 5
+        assert pool.connection_kwargs['parser_class'] is parser_class
+    broker = create_broker(
+        'redis://localhost:6379/0', separate_subscriber_pool=False
+    )
+    assert broker._subscriber is broker._redis
+    with pytest.raises(ValueError):
+        create_broker('redis://localhost:6379/0', parser='other')
@@ -0,0 +1,30 @@
+import pytest
+
+from distributed_websocket._codec import Codec, JSONCodec, get_codec
+from distributed_websocket.utils import is_valid_json
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson', 'msgspec'])
+def test_codec(name: str):
+    if name != 'json':
+        pytest.importorskip(name)
+    codec = get_codec(name)
+    data = {'type': 'send', 'topic': 'test/1', 'conn_id': None, 'msg': 'è'}
+    assert isinstance(codec.dumps(data), str)
+    assert isinstance(codec.dumpb(data), bytes)
+    assert codec.loads(codec.dumps(data)) == data
+    assert codec.loads(codec.dumpb(data)) == data
+    with pytest.raises(ValueError):
+        codec.loads(b'{"msg": ')
+    assert is_valid_json('{"msg": "hello"}', codec)
+    assert not is_valid_json('{"msg": ', codec)
+
+
+def test_get_codec():
+    assert isinstance(get_codec(), JSONCodec)
+    codec = JSONCodec()
+    assert get_codec(codec) is codec
+    with pytest.raises(ValueError):
+        get_codec('yaml')
+    with pytest.raises(TypeError):
+        Codec()
@@ -0,0 +1,76 @@
+import pytest
+
+from distributed_websocket._broker import create_broker
+from distributed_websocket._compression import (
+    FrameCompressor,
+    compress,
+    decompress,
+    is_compressed,
+    validate_compression,
+)
+from distributed_websocket._envelope import pack_envelope
+from distributed_websocket._message import untag_broker_message
+
+
+def test_compress():
+    data = b'{"msg": "hello"}' * 10
+    compressed = compress(data)
+    assert is_compressed(compressed) and not is_compressed(data)
+    assert len(compressed) < len(data)
+    assert decompress(compressed) == data
+    with pytest.raises(ValueError):
+        validate_compression('lz4')
+
+
+@pytest.mark.parametrize('envelope', ['json', 'binary'])
+def test_envelope_compression(envelope):
+    def message(size):
+        return {
+            'type': 'send',
+            'topic': 'a/b',
+            'conn_id': None,
+            'x': 'x' * size,
+        }
+
+    small = pack_envelope(message(10), envelope, compression='zlib')
+    large = pack_envelope(message(1000), envelope, compression='zlib')
+    assert not is_compressed(small)
+    assert is_compressed(large) and len(large) < 1000
+    typ, topic, conn_id, data = untag_broker_message(large)
+    assert (typ, topic, conn_id, data) == (
+        'send',
+        'a/b',
+        None,
+        {'x': 'x' * 1000},
+    )
+
+
+def test_envelope_compression_zstd():
+    pytest.importorskip('zstandard')
+    packed = pack_envelope(
+        {'type': 'broadcast', 'topic': None, 'conn_id': None, 'x': 'x' * 1000},
+        compression='zstd',
+    )
+    assert untag_broker_message(packed)[3] == {'x': 'x' * 1000}
+
+
+def test_frame_compressor():
+    compressor = FrameCompressor(cache_size=1)
+    frame = 'x' * 1000
+    compressed = compressor.compress(frame)
+    # the same frame is compressed once
+    assert compressor.compress(frame) is compressed
+    compressor.compress('y' * 1000)
+    assert compressor.compress(frame) is not compressed
+
+
+def test_broker_compression_options():
+    broker = create_broker(
+        'redis://localhost:6379/0?compression=zlib&compression_threshold=10'
+    )
+    assert (broker.compression, broker.compression_threshold) == ('zlib', 10)
+    # left in the url of the brokers without compression
+    broker = create_broker('memory://?compression=zlib')
+    assert not hasattr(broker, 'compression')
+    with pytest.raises(ValueError):
+        create_broker('redis://localhost:6379/0', compression='lz4')
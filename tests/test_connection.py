@@ -1,4 +1,6 @@
+import asyncio
 from collections.abc import Callable
+from unittest.mock import AsyncMock
 
 import pytest
 from starlette import status
@@ -62,3 +64,205 @@ def test_connection_iter(
         websocket.send_json({'type': 'broadcast', 'msg': 'hello'})
         data2 = websocket.receive_json()
         assert data2 == {'your_id': 'test', 'msg': {'msg': 'hello'}}
+
+
+def test_connection_enqueue(
+    test_client_factory: Callable[[Callable[[Scope, Receive, Send], None]], TestClient]
+) -> None:
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive=receive, send=send)
+        await websocket.accept()
+        connection = Connection(websocket, 'test', max_queue_size=2)
+        assert connection.enqueue({'msg': 1})
+        assert connection.enqueue({'msg': 2})
+        assert not connection.enqueue({'msg': 3})
+        connection.start_writer()
+        async for data in connection.iter_json():
+            connection.enqueue(data)
+        connection.stop_writer()
+
+    client = test_client_factory(app)
+    with client.websocket_connect('/') as websocket:
+        assert websocket.receive_json() == {'msg': 1}
+        assert websocket.receive_json() == {'msg': 2}
+        websocket.send_json({'msg': 4})
+        assert websocket.receive_json() == {'msg': 4}
+
+
+def test_connection_conflate(
+    test_client_factory: Callable[[Callable[[Scope, Receive, Send], None]], TestClient]
+) -> None:
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive=receive, send=send)
+        await websocket.accept()
+        connection = Connection(websocket, 'test', conflate=True)
+        for i in range(3):
+            assert connection.enqueue({'a': i}, 'a')
+            assert connection.enqueue({'b': i}, 'b')
+        assert connection.conflated_messages == 4
+        connection.start_writer()
+        async for data in connection.iter_json():
+            break
+        connection.stop_writer()
+
+    client = test_client_factory(app)
+    with client.websocket_connect('/') as websocket:
+        assert websocket.receive_json() == {'a': 2}
+        assert websocket.receive_json() == {'b': 2}
+        websocket.send_json({})
+
+
+def test_connection_batching(
+    test_client_factory: Callable[[Callable[[Scope, Receive, Send], None]], TestClient]
+) -> None:
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive=receive, send=send)
+        await websocket.accept()
+        connection = Connection(websocket, 'test', batch_max_size=3)
+        for i in range(5):
+            connection.enqueue({'msg': i})
+        connection.start_writer()
+        async for data in connection.iter_json():
+            break
+        connection.stop_writer()
+
+    client = test_client_factory(app)
+    with client.websocket_connect('/') as websocket:
+        assert websocket.receive_json() == [{'msg': 0}, {'msg': 1}, {'msg': 2}]
+        assert websocket.receive_json() == [{'msg': 3}, {'msg': 4}]
+        websocket.send_json({})
+
+
+def test_connection_batching_turned_off(
+    test_client_factory: Callable[[Callable[[Scope, Receive, Send], None]], TestClient]
+) -> None:
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive=receive, send=send)
+        await websocket.accept()
+        connection = Connection(
+            websocket, 'test', batch_max_size=3, batch_max_delay=0.05
+        )
+        connection.enqueue({'msg': 0})
+        connection.enqueue({'msg': 1})
+        connection.start_writer()
+        await asyncio.sleep(0.01)
+        # while the writer waits for a third message
+        connection.set_batching(None)
+        connection.enqueue({'msg': 2})
+        async for data in connection.iter_json():
+            break
+        connection.stop_writer()
+
+    client = test_client_factory(app)
+    with client.websocket_connect('/') as websocket:
+        assert websocket.receive_json() == [{'msg': 0}, {'msg': 1}, {'msg': 2}]
+        websocket.send_json({})
+
+
+def test_connection_backpressure_close(
+    test_client_factory: Callable[[Callable[[Scope, Receive, Send], None]], TestClient]
+) -> None:
+    events = []
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive=receive, send=send)
+        await websocket.accept()
+        connection = Connection(
+            websocket,
+            'test',
+            max_queue_bytes=16,
+            backpressure_policy='close',
+            on_backpressure=lambda c, e: events.append(e),
+        )
+        assert connection.enqueue({'msg': 'hello'})
+        assert not connection.enqueue({'msg': 'hello'})
+        assert connection.backpressure_events == {'close': 1}
+        assert connection.queue_size == connection.queue_bytes == 0
+        async for _ in connection.iter_json():
+            pass
+
+    client = test_client_factory(app)
+    with client.websocket_connect('/') as websocket:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            websocket.receive_json()
+        assert exc.value.code == status.WS_1013_TRY_AGAIN_LATER
+    assert events == ['close']
+
+
+@pytest.mark.asyncio
+async def test_connection_writer_socket_gone() -> None:
+    websocket = AsyncMock()
+    websocket.send_text.side_effect = RuntimeError('closed')
+    closed = []
+    connection = Connection(websocket, 'test', on_close=closed.append)
+    connection.start_writer()
+    assert connection.enqueue({'msg': 'hello'})
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert closed == [connection]
+    assert connection.closed
+    assert not connection.enqueue({'msg': 'hello'})
+    assert connection.queue_size == 0
+
+
+@pytest.mark.asyncio
+async def test_connection_close_once() -> None:
+    websocket = AsyncMock()
+    closed = []
+    connection = Connection(
+        websocket,
+        'test',
+        max_queue_size=1,
+        backpressure_policy='close',
+        on_close=closed.append,
+    )
+    assert connection.enqueue({'msg': 1})
+    assert not connection.enqueue({'msg': 2})
+    await asyncio.sleep(0)
+    assert closed == [connection]
+    await connection.close()
+    websocket.close.assert_awaited_once_with(status.WS_1013_TRY_AGAIN_LATER)
+
+
+@pytest.mark.asyncio
+async def test_connection_send_error() -> None:
+    websocket = AsyncMock()
+    connection = Connection(websocket, 'test')
+    # encoded by the codec
+    await connection.send_error('invalid')
+    websocket.send_text.assert_awaited_once_with('{"error": "invalid"}')
+    websocket.send_json.assert_not_called()
+    websocket.send_text.reset_mock()
+    # queued after the messages waiting to be sent
+    connection.enqueue({'msg': 1})
+    connection.start_writer()
+    await connection.send_error('invalid')
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert [c.args for c in websocket.send_text.await_args_list] == [
+        ('{"msg": 1}',),
+        ('{"error": "invalid"}',),
+    ]
+    connection.stop_writer()
+
+
+def test_connection_iter_bytes(
+    test_client_factory: Callable[[Callable[[Scope, Receive, Send], None]], TestClient]
+) -> None:
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive=receive, send=send)
+        await websocket.accept()
+        connection = Connection(websocket, 'test')
+        async for msg in connection:
+            if msg is not None:
+                await connection.send_json(
+                    {'your_id': connection.id, 'msg': msg.data}
+                )
+
+    client = test_client_factory(app)
+    with client.websocket_connect('/') as websocket:
+        websocket.send_bytes(b'{"type": "broadcast", "msg": "hello"}')
+        data = websocket.receive_json()
+        assert data == {'your_id': 'test', 'msg': {'msg': 'hello'}}
+        websocket.send_bytes(b'{"type": ')
+        assert 'error' in websocket.receive_json()
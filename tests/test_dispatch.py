@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from distributed_websocket._dispatch import Dispatcher
+
+
+def test_dispatcher_invalid_concurrency():
+    with pytest.raises(ValueError):
+        Dispatcher(0)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_max_concurrency():
+    dispatcher = Dispatcher(2)
+    release = asyncio.Event()
+    done = []
+
+    async def job(i: int) -> None:
+        await release.wait()
+        done.append(i)
+
+    for i in range(5):
+        dispatcher.submit(job(i))
+    assert dispatcher.in_flight == 2
+    assert dispatcher.queue_depth == 3
+    assert len(dispatcher) == 5
+    release.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert done == [0, 1, 2, 3, 4]
+    # finished tasks are forgotten
+    assert len(dispatcher) == 0
+    assert list(dispatcher) == []
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_cancel():
+    dispatcher = Dispatcher(1)
+    started = []
+
+    async def job(i: int) -> None:
+        started.append(i)
+        await asyncio.sleep(10)
+
+    for i in range(3):
+        dispatcher.submit(job(i))
+    await asyncio.sleep(0)
+    tasks = list(dispatcher)
+    dispatcher.cancel()
+    await asyncio.wait(tasks)
+    await asyncio.sleep(0)
+    assert started == [0]
+    assert all(task.cancelled() for task in tasks)
+    assert len(dispatcher) == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_logs_exceptions(caplog):
+    dispatcher = Dispatcher(1)
+    done = []
+
+    async def fail() -> None:
+        raise RuntimeError('boom')
+
+    async def job() -> None:
+        done.append(True)
+
+    dispatcher.submit(fail())
+    dispatcher.submit(job())
+    for _ in range(5):
+        await asyncio.sleep(0)
+    # the failed task released its slot
+    assert done == [True]
+    assert len(dispatcher) == 0
+    [record] = caplog.records
+    assert record.exc_info[1].args == ('boom',)
@@ -0,0 +1,105 @@
+import pytest
+
+from distributed_websocket._broker import create_broker
+from distributed_websocket._codec import get_codec
+from distributed_websocket._envelope import (
+    is_binary_envelope,
+    pack_envelope,
+    unpack_envelope,
+)
+from distributed_websocket._message import Message, untag_broker_message
+
+
+@pytest.mark.parametrize(
+    'typ,topic,conn_id',
+    [
+        ('send', 'tests/è', None),
+        ('broadcast', None, None),
+        ('send_by_conn_id', None, 'conn1'),
+        ('send_by_conn_id', None, ['conn1', 'conn2']),
+    ],
+)
+def test_binary_envelope(typ, topic, conn_id):
+    message = Message(data={'msg': 'hello'}, typ=typ, topic=topic, conn_id=conn_id)
+    data = pack_envelope(message, 'binary')
+    assert is_binary_envelope(data)
+    assert unpack_envelope(data) == (typ, topic, conn_id, {'msg': 'hello'})
+    assert untag_broker_message(data) == (typ, topic, conn_id, {'msg': 'hello'})
+
+
+def test_json_envelope():
+    data = pack_envelope(
+        {'type': 'send', 'topic': 'a/b', 'conn_id': None, 'msg': 'hello'}, 'json'
+    )
+    assert not is_binary_envelope(data)
+    assert untag_broker_message(data) == ('send', 'a/b', None, {'msg': 'hello'})
+
+
+def test_msgpack_envelope():
+    pytest.importorskip('msgpack')
+    data = pack_envelope(
+        {'type': 'send', 'topic': 'a/b', 'conn_id': None, 'msg': b'\x00'}, 'msgpack'
+    )
+    assert untag_broker_message(data) == ('send', 'a/b', None, {'msg': b'\x00'})
+
+
+def test_envelope_codec():
+    pytest.importorskip('orjson')
+    codec = get_codec('orjson')
+    data = pack_envelope(
+        {'type': 'send', 'topic': 'a/b', 'conn_id': ['c1'], 'msg': 'hello'},
+        'binary',
+        codec,
+    )
+    assert untag_broker_message(data, codec) == ('send', 'a/b', ['c1'], {'msg': 'hello'})
+
+
+@pytest.mark.parametrize('envelope', ['json', 'binary', 'msgpack'])
+@pytest.mark.parametrize('origin', [None, 'node1'])
+def test_pack_message(envelope, origin):
+    if envelope == 'msgpack':
+        pytest.importorskip('msgpack')
+    payload = {'msg': 'hello'}
+    message = Message(
+        data=payload, typ='send', topic='a/b', conn_id=None, origin=origin
+    )
+    data = pack_envelope(message, envelope)
+    # the payload is neither modified nor copied into the envelope
+    assert message.data is payload
+    assert payload == {'msg': 'hello'}
+    serialized = {'type': 'send', 'topic': 'a/b', 'conn_id': None, **payload}
+    if origin is not None:
+        serialized['__node_id__'] = origin
+    assert untag_broker_message(data) == untag_broker_message(
+        pack_envelope(serialized, envelope)
+    )
+    m = Message.from_broker_message(data)
+    assert (m.typ, m.topic, m.conn_id, m.origin) == ('send', 'a/b', None, origin)
+    assert m.data == {'msg': 'hello'}
+    empty = Message(data={}, typ='broadcast')
+    assert Message.from_broker_message(pack_envelope(empty, envelope)).data == {}
+
+
+def test_binary_envelope_long_fields():
+    conn_ids = [f'conn{i:012}' for i in range(5000)]
+    message = Message(data={'msg': 'hello'}, typ='send_by_conn_id', conn_id=conn_ids)
+    data = pack_envelope(message, 'binary')
+    # falls back to the json envelope
+    assert not is_binary_envelope(data)
+    m = Message.from_broker_message(data)
+    assert (m.conn_id, m.data) == (conn_ids, {'msg': 'hello'})
+    data = pack_envelope(
+        {'type': 'send', 'topic': 'a/' * 40000, 'conn_id': None}, 'binary'
+    )
+    assert untag_broker_message(data) == ('send', 'a/' * 40000, None, {})
+
+
+def test_envelope_option():
+    with pytest.raises(ValueError):
+        pack_envelope({'type': 'send'}, 'xml')
+    broker = create_broker('redis://localhost:6379/0?envelope=binary')
+    assert broker.envelope == 'binary'
+    assert 'envelope' not in broker._redis.connection_pool.connection_kwargs
+    broker = create_broker('redis://localhost:6379/0', envelope='binary')
+    assert broker.envelope == 'binary'
+    assert create_broker('redis://localhost:6379/0').envelope == 'json'
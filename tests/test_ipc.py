@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from distributed_websocket._broker import create_broker
+from distributed_websocket.utils import is_valid_broker
+
+
+def _message(i: int) -> dict:
+    return {'type': 'broadcast', 'topic': None, 'conn_id': None, 'i': i}
+
+
+@pytest.mark.asyncio
+async def test_ipc_broker(tmp_path) -> None:
+    url = f'ipc://{tmp_path}/hub.sock'
+    broker1 = create_broker(url)
+    broker2 = create_broker(url)
+    assert is_valid_broker(broker1)
+    await broker1.connect()
+    await broker2.connect()
+    # the first broker runs the hub
+    assert broker1.hub is not None and broker2.hub is None
+    await broker1.subscribe('test')
+    await broker2.subscribe('test')
+    await broker2.psubscribe('other:*')
+    # let the hub process the subscriptions
+    await asyncio.sleep(0.05)
+    await broker2.publish('test', _message(1))
+    await broker1.publish('other:1', _message(2))
+    await broker1.publish('nobody', _message(3))
+    received = await asyncio.wait_for(broker1.get_message(), 1)
+    assert received.data == {'i': 1}
+    received = [
+        await asyncio.wait_for(broker2.get_message(), 1) for _ in range(2)
+    ]
+    assert [m.data for m in received] == [{'i': 1}, {'i': 2}]
+    assert broker1._messages.empty() and broker2._messages.empty()
+    # the hub goes away: the other broker takes over, subscriptions included
+    await broker1.disconnect()
+    for _ in range(100):
+        if broker2.hub is not None:
+            break
+        await asyncio.sleep(0.01)
+    assert broker2.hub is not None
+    broker3 = create_broker(url)
+    await broker3.connect()
+    assert broker3.hub is None
+    await asyncio.sleep(0.05)
+    await broker3.publish('test', _message(4))
+    received = await asyncio.wait_for(broker2.get_message(), 1)
+    assert received.data == {'i': 4}
+    await broker3.disconnect()
+    await broker2.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_ipc_broker_publish_many(tmp_path) -> None:
+    async with create_broker(f'ipc://{tmp_path}/hub.sock') as broker:
+        await broker.subscribe('test')
+        await asyncio.sleep(0.05)
+        await broker.publish_many(
+            [
+                ('test', _message(1)),
+                ('other', _message(2)),
+                ('test', _message(3)),
+            ]
+        )
+        received = [await asyncio.wait_for(broker.get_message(), 1)]
+        while len(received) < 2:
+            received += await asyncio.wait_for(broker.get_messages(10), 1)
+        assert [m.data for m in received] == [{'i': 1}, {'i': 3}]
+
+
+@pytest.mark.asyncio
+async def test_ipc_hub_close(tmp_path) -> None:
+    url = f'ipc://{tmp_path}/hub.sock'
+    broker1 = create_broker(url)
+    broker2 = create_broker(url)
+    await broker1.connect()
+    await broker2.connect()
+    hub = broker1.hub
+    await asyncio.sleep(0.05)
+    handlers = set(hub._handlers)
+    assert len(handlers) == 2
+    await hub.close()
+    # the handlers are done, and did not end cancelled
+    assert not hub._handlers
+    assert all(task.done() and not task.cancelled() for task in handlers)
+    broker1.hub = None
+    await broker1.disconnect()
+    await broker2.disconnect()
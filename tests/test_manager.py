@@ -1,6 +1,9 @@
 import asyncio
+import json
 import signal
+import zlib
 from collections.abc import Callable
+from unittest.mock import AsyncMock
 
 import pytest
 from starlette import status
@@ -35,7 +38,7 @@ def test_manager_01(
         msg = websocket.receive_json()
         assert msg == {'msg': 'hello'}
 
-    for t in manager._send_tasks:
+    for t in manager.dispatcher:
         if not t.done():
             t.cancel()
 
@@ -69,7 +72,7 @@ def test_manager_02(
         msg2 = w2.receive_json()
         assert msg1 == msg2 == {'msg': 'hello'}
 
-    for t in manager._send_tasks:
+    for t in manager.dispatcher:
         if not t.done():
             t.cancel()
 
@@ -318,3 +321,579 @@ async def test_manager_send_by_conn_id_02(
         assert msg2 == {'msg': 'hello'}
 
     await manager.shutdown()
+
+
+def test_manager_conn_id_index(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ]
+):
+    manager = WebSocketManager('test', 'memory://')
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        conn_id = websocket.query_params['myid']
+        connection = await manager.new_connection(websocket, conn_id)
+        if conn_id == 'conn3':
+            manager.set_conn_id(connection, 'conn2')
+            assert manager._connections_by_id['conn2'] == {connection}
+            assert 'conn3' not in manager._connections_by_id
+        async for m in connection:
+            manager.send_by_conn_id(m)
+        manager.remove_connection(connection)
+
+    test_client1 = test_client_factory(app)
+    test_client2 = test_client_factory(app)
+    test_client3 = test_client_factory(app)
+    with test_client1.websocket_connect(
+        '/?myid=conn1'
+    ) as w1, test_client2.websocket_connect(
+        '/?myid=conn1'
+    ) as w2, test_client3.websocket_connect(
+        '/?myid=conn3'
+    ) as w3:
+        assert w3.receive_json() == {'type': 'set_conn_id', 'conn_id': 'conn2'}
+        w3.send_json(
+            {'type': 'send_by_conn_id', 'conn_id': 'conn1', 'msg': 'hello'}
+        )
+        assert w1.receive_json() == w2.receive_json() == {'msg': 'hello'}
+        w1.send_json(
+            {
+                'type': 'send_by_conn_id',
+                'conn_id': ['conn1', 'conn2', 'conn1'],
+                'msg': 'hi',
+            }
+        )
+        assert w1.receive_json() == w2.receive_json() == {'msg': 'hi'}
+        assert w3.receive_json() == {'msg': 'hi'}
+        w1.close()
+        w2.close()
+        w3.close()
+
+    assert manager._connections_by_id == {}
+    for t in manager.dispatcher:
+        if not t.done():
+            t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_manager_backpressure_close_disconnects():
+    manager = WebSocketManager(
+        'test',
+        'memory://',
+        connection_queue_size=1,
+        backpressure_policy='close',
+    )
+    await manager.startup()
+    websocket = AsyncMock()
+    connection = await manager.new_connection(websocket, 'c1', 'a/b')
+    connection.stop_writer()
+    assert connection.enqueue({'msg': 1})
+    assert not connection.enqueue({'msg': 2})
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert manager.active_connections == []
+    assert manager._connections_by_id == {}
+    assert manager._subscription_index.match('a/b') == set()
+    await manager.shutdown()
+    assert websocket.close.await_count == 1
+
+
+def test_manager_encode_once(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ]
+):
+    manager = WebSocketManager('test', 'memory://')
+    encoded = []
+    encode = manager._encode
+    manager._encode = lambda message: encoded.append(message) or encode(
+        message
+    )
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        conn_id = websocket.query_params['myid']
+        connection = await manager.new_connection(websocket, conn_id)
+        connection.topics.add('tests/+')
+        async for m in connection:
+            manager.send_msg(m)
+        manager.remove_connection(connection)
+
+    test_client1 = test_client_factory(app)
+    test_client2 = test_client_factory(app)
+    with test_client1.websocket_connect(
+        '/?myid=conn1'
+    ) as w1, test_client2.websocket_connect('/?myid=conn2') as w2:
+        for typ, topic, conn_id in (
+            ('send', 'tests/1', None),
+            ('broadcast', None, None),
+            ('send_by_conn_id', None, ['conn1', 'conn2']),
+        ):
+            w1.send_json(
+                {'type': typ, 'topic': topic, 'conn_id': conn_id, 'msg': typ}
+            )
+            assert w1.receive_json() == w2.receive_json() == {'msg': typ}
+        w1.close()
+        w2.close()
+
+    assert [m.typ for m in encoded] == ['send', 'broadcast', 'send_by_conn_id']
+    for t in manager.dispatcher:
+        if not t.done():
+            t.cancel()
+
+
+async def _wait_for(condition: Callable[[], bool]) -> None:
+    # the app runs in the test client thread
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert condition()
+
+
+@pytest.mark.asyncio
+async def test_manager_topic_routing(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ],
+):
+    manager = WebSocketManager(
+        'test', 'memory://', broker_routing='topic', broker_topic_depth=2
+    )
+    await manager.startup()
+    published = []
+    publish = manager.broker.publish
+
+    async def record(channel, message):
+        published.append(channel)
+        await publish(channel, message)
+
+    manager.broker.publish = record
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        conn_id = websocket.query_params['myid']
+        connection = await manager.new_connection(websocket, conn_id)
+        async for m in connection:
+            await manager.receive(connection, m)
+        manager.remove_connection(connection)
+
+    test_client1 = test_client_factory(app)
+    test_client2 = test_client_factory(app)
+    with test_client1.websocket_connect(
+        '/?myid=conn1'
+    ) as w1, test_client2.websocket_connect('/?myid=conn2') as w2:
+        w1.send_json({'type': 'subscribe', 'topic': 'tests/1'})
+        w2.send_json({'type': 'subscribe', 'topic': 'other/+'})
+        await _wait_for(
+            lambda: manager.broker._subscribers == {'test', 'test:tests/1'}
+            and set(manager.broker._patterns) == {'test:other/*'}
+        )
+        for topic in ('tests/1', 'tests/2', 'other/2', 'other/3'):
+            w1.send_json({'type': 'send', 'topic': topic, 'msg': topic})
+        w1.send_json({'type': 'broadcast', 'msg': 'all'})
+        await _wait_for(lambda: len(published) == 5)
+        await asyncio.sleep(0.01)
+        assert w1.receive_json() == {'msg': 'tests/1'}
+        assert w1.receive_json() == {'msg': 'all'}
+        assert w2.receive_json() == {'msg': 'other/2'}
+        assert w2.receive_json() == {'msg': 'other/3'}
+        assert w2.receive_json() == {'msg': 'all'}
+        assert published == [
+            'test:tests/1',
+            'test:tests/2',
+            'test:other/2',
+            'test:other/3',
+            'test',
+        ]
+        w2.send_json({'type': 'unsubscribe', 'topic': 'other/+'})
+        await _wait_for(lambda: manager.broker._patterns == {})
+        w1.close()
+        w2.close()
+
+    await _wait_for(lambda: manager.broker._subscribers == {'test'})
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_manager_topic_routing_broker_errors():
+    manager = WebSocketManager('test', 'memory://', broker_routing='topic')
+    manager.broker_sync_retry_delay = 0.01
+    await manager.startup()
+    subscribe = manager.broker.subscribe
+    failures = [ConnectionError()]
+
+    async def flaky_subscribe(channel):
+        if failures:
+            raise failures.pop()
+        await subscribe(channel)
+
+    manager.broker.subscribe = flaky_subscribe
+    manager._router_add('t/a')
+    await _wait_for(lambda: not failures)
+    # not recorded as subscribed until the retry succeeds
+    assert manager._broker_channels == set()
+    await _wait_for(lambda: manager._broker_channels == {'test:t/a'})
+    assert 'test:t/a' in manager.broker._subscribers
+    failures.append(ConnectionError())
+    manager._router_add('t/b')
+    await _wait_for(lambda: not failures)
+    # a failing sync does not stop the shutdown
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_manager_direct_routing(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ],
+):
+    manager = WebSocketManager(
+        'test', 'memory://', direct_routing=True, node_id='node1'
+    )
+    await manager.startup()
+    assert manager.broker._subscribers == {'test', 'test@node1'}
+    published = []
+    publish = manager.broker.publish
+
+    async def record(channel, message):
+        published.append(channel)
+        await publish(channel, message)
+
+    manager.broker.publish = record
+    # a connection of another node
+    await manager.broker.register_conn_ids(['conn3'], 'node2', 60)
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        conn_id = websocket.query_params['myid']
+        connection = await manager.new_connection(websocket, conn_id)
+        async for m in connection:
+            await manager.receive(connection, m)
+        manager.remove_connection(connection)
+
+    test_client1 = test_client_factory(app)
+    test_client2 = test_client_factory(app)
+    with test_client1.websocket_connect(
+        '/?myid=conn1'
+    ) as w1, test_client2.websocket_connect('/?myid=conn2') as w2:
+        await _wait_for(lambda: len(manager.broker.hub._registry) == 3)
+        for conn_id in ('conn2', 'conn4', ['conn2', 'conn3']):
+            w1.send_json(
+                {'type': 'send_by_conn_id', 'conn_id': conn_id, 'msg': 'hi'}
+            )
+        await _wait_for(lambda: len(published) == 3)
+        await asyncio.sleep(0.01)
+        assert w2.receive_json() == w2.receive_json() == {'msg': 'hi'}
+        assert published == ['test@node1', 'test@node1', 'test@node2']
+        w1.close()
+        w2.close()
+
+    await _wait_for(lambda: list(manager.broker.hub._registry) == ['conn3'])
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_manager_shutdown_unregisters_connections():
+    manager = WebSocketManager(
+        'test', 'memory://', direct_routing=True, node_id='node1'
+    )
+    await manager.startup()
+    websockets = [AsyncMock() for _ in range(3)]
+    for i, websocket in enumerate(websockets):
+        await manager.new_connection(websocket, f'conn{i}')
+    await _wait_for(lambda: len(manager.broker.hub._registry) == 3)
+    await manager.shutdown()
+    assert manager.active_connections == []
+    assert all(websocket.close.await_count == 1 for websocket in websockets)
+    assert manager.broker.hub._registry == {}
+
+
+@pytest.mark.asyncio
+async def test_manager_registry_broker_errors():
+    manager = WebSocketManager(
+        'test',
+        'memory://',
+        direct_routing=True,
+        node_id='node1',
+        registry_ttl=0.03,
+    )
+    await manager.startup()
+    register = manager.broker.register_conn_ids
+    failures = [ConnectionError(), ConnectionError()]
+
+    async def flaky_register(*args):
+        if failures:
+            raise failures.pop()
+        await register(*args)
+
+    manager.broker.register_conn_ids = flaky_register
+    await manager.new_connection(AsyncMock(), 'c1')
+    # the failed registration is kept, and made by a later refresh
+    await _wait_for(lambda: manager._registry_task.done())
+    assert manager._registry_changes == {'c1': True}
+    await _wait_for(lambda: not failures)
+    await _wait_for(lambda: 'c1' in manager.broker.hub._registry)
+    assert not manager._registry_refresh_task.done()
+    assert await manager.broker.locate_conn_ids(['c1']) == {'c1': {'node1'}}
+    await manager.shutdown()
+
+
+def test_manager_unsupported_routing(tmp_path):
+    with pytest.raises(ValueError, match='psubscribe'):
+        WebSocketManager(
+            'test', 'redis-streams://localhost:6379/0', broker_routing='topic'
+        )
+    for url in (f'ipc://{tmp_path}/hub.sock', 'mesh://127.0.0.1:0'):
+        with pytest.raises(ValueError, match='registry'):
+            WebSocketManager('test', url, direct_routing=True)
+    WebSocketManager('test', 'mesh://127.0.0.1:0', broker_routing='topic')
+
+
+@pytest.mark.asyncio
+async def test_manager_local_delivery(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ],
+):
+    manager = WebSocketManager(
+        'test', 'memory://', local_delivery=True, node_id='node1'
+    )
+    await manager.startup()
+    published = []
+    publish = manager.broker.publish
+
+    async def record(channel, message):
+        published.append(message)
+        await publish(channel, message)
+
+    manager.broker.publish = record
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        conn_id = websocket.query_params['myid']
+        connection = await manager.new_connection(websocket, conn_id)
+        async for m in connection:
+            await manager.receive(connection, m)
+        manager.remove_connection(connection)
+
+    test_client1 = test_client_factory(app)
+    test_client2 = test_client_factory(app)
+    with test_client1.websocket_connect(
+        '/?myid=conn1'
+    ) as w1, test_client2.websocket_connect('/?myid=conn2') as w2:
+        w2.send_json({'type': 'subscribe', 'topic': 'tests/1'})
+        await asyncio.sleep(0.01)
+        w1.send_json({'type': 'send', 'topic': 'tests/1', 'msg': 1})
+        w1.send_json({'type': 'send_by_conn_id', 'conn_id': 'conn2', 'msg': 2})
+        await _wait_for(lambda: len(published) == 2)
+        assert all(m.origin == 'node1' for m in published)
+        # a message of another node
+        await publish(
+            'test',
+            {
+                'type': 'broadcast',
+                'topic': None,
+                'conn_id': None,
+                '__node_id__': 'node2',
+                'msg': 3,
+            },
+        )
+        await asyncio.sleep(0.01)
+        # the echoes of the first two messages are dropped
+        assert w2.receive_json() == {'msg': 1}
+        assert w2.receive_json() == {'msg': 2}
+        assert w2.receive_json() == {'msg': 3}
+        assert w1.receive_json() == {'msg': 3}
+        w1.close()
+        w2.close()
+
+    await manager.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_manager_broker_batches():
+    with pytest.raises(ValueError):
+        WebSocketManager('test', 'memory://', broker_batch_size=0)
+    manager = WebSocketManager('test', 'memory://', broker_batch_size=3)
+    await manager.startup()
+    batches = []
+    manager._deliver_batch = lambda messages: batches.append(
+        [m.data for m in messages]
+    ) or asyncio.sleep(0)
+    for i in range(5):
+        await manager.broker.publish(
+            'test',
+            {'type': 'broadcast', 'topic': None, 'conn_id': None, 'i': i},
+        )
+    await _wait_for(lambda: len(batches) == 2)
+    assert batches == [
+        [{'i': 0}, {'i': 1}, {'i': 2}],
+        [{'i': 3}, {'i': 4}],
+    ]
+    await manager.shutdown()
+
+
+class _Recipient:
+    def __init__(self) -> None:
+        self.queued = []
+
+    def enqueue_frame(self, frame, key=None, conflate=False) -> None:
+        self.queued.append((frame, key, conflate))
+
+
+def test_manager_conflation():
+    manager = WebSocketManager(
+        'test',
+        'memory://',
+        conflate_topics=['prices/#'],
+        conflation_key='symbol',
+    )
+    recipient = _Recipient()
+    for topic, data in (
+        ('prices/eu', {'symbol': 'A', 'p': 1}),
+        ('prices/eu', {'p': 2}),
+        ('news', {'symbol': 'A'}),
+        ('news', {'symbol': ['A']}),
+    ):
+        manager._enqueue(
+            [recipient], Message(data=data, typ='send', topic=topic)
+        )
+    assert [q[1:] for q in recipient.queued] == [
+        (('prices/eu', 'A'), True),
+        ('prices/eu', True),
+        (('news', 'A'), False),
+        ('news', False),
+    ]
+
+
+def test_manager_connect_batching(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ]
+):
+    manager = WebSocketManager('test', 'memory://', max_batch_size=10)
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        connection = await manager.new_connection(websocket, 'conn1')
+        async for m in connection:
+            if m.typ == 'send':
+                for i in range(3):
+                    connection.enqueue({'i': i})
+            else:
+                await manager.receive(connection, m)
+        manager.remove_connection(connection)
+
+    test_client = test_client_factory(app)
+    with test_client.websocket_connect('/') as websocket:
+        websocket.send_json({'type': 'connect', 'batch': 'yes'})
+        assert 'error' in websocket.receive_json()
+        for batch in ({'max_size': float('inf')}, {'max_delay': float('nan')}):
+            websocket.send_json({'type': 'connect', 'batch': batch})
+            assert 'error' in websocket.receive_json()
+        websocket.send_json(
+            {'type': 'connect', 'batch': {'max_size': 50, 'max_delay': 0.01}}
+        )
+        assert websocket.receive_json() == [
+            {
+                'type': 'connect',
+                'batch': {'max_size': 10, 'max_delay': 0.005},
+                'compress': None,
+            }
+        ]
+        websocket.send_json({'type': 'send', 'topic': 'tests/1'})
+        assert websocket.receive_json() == [{'i': 0}, {'i': 1}, {'i': 2}]
+        websocket.send_json({'type': 'connect'})
+        assert websocket.receive_json() == {
+            'type': 'connect',
+            'batch': None,
+            'compress': None,
+        }
+        websocket.close()
+
+
+@pytest.mark.asyncio
+async def test_manager_receive_batch(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ],
+):
+    manager = WebSocketManager('test', 'memory://')
+    await manager.startup()
+    published = []
+    publish_many = manager.broker.publish_many
+
+    async def record(messages):
+        published.append([channel for channel, _ in messages])
+        await publish_many(messages)
+
+    manager.broker.publish_many = record
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        connection = await manager.new_connection(websocket, 'conn1')
+        async for m in connection:
+            await manager.receive(connection, m)
+        manager.remove_connection(connection)
+
+    test_client = test_client_factory(app)
+    with test_client.websocket_connect('/') as websocket:
+        websocket.send_json([{'type': 'broadcast'}, {'type': 'send'}])
+        assert websocket.receive_json() == {
+            'error': 'Invalid message at index 1: '
+            'Invalid message type "send" with no topic'
+        }
+        websocket.send_json(
+            [
+                {'type': 'subscribe', 'topic': 'tests/1'},
+                {'type': 'send', 'topic': 'tests/1', 'msg': 1},
+                {'type': 'send', 'topic': 'tests/2', 'msg': 2},
+                {'type': 'broadcast', 'msg': 3},
+            ]
+        )
+        await _wait_for(lambda: len(published) == 1)
+        await asyncio.sleep(0.01)
+        assert websocket.receive_json() == {'msg': 1}
+        assert websocket.receive_json() == {'msg': 3}
+        assert published == [['test', 'test', 'test']]
+        websocket.close()
+
+    await manager.shutdown()
+
+
+def test_manager_connect_compression(
+    test_client_factory: Callable[
+        [Callable[[Scope, Receive, Send], None]], TestClient
+    ]
+):
+    manager = WebSocketManager(
+        'test', 'memory://', frame_compression_threshold=100
+    )
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive, send)
+        connection = await manager.new_connection(websocket, 'conn1')
+        async for m in connection:
+            if m.typ == 'send':
+                connection.enqueue({'msg': 'x'})
+                connection.enqueue({'msg': 'x' * 1000})
+            else:
+                await manager.receive(connection, m)
+        manager.remove_connection(connection)
+
+    test_client = test_client_factory(app)
+    with test_client.websocket_connect('/') as websocket:
+        websocket.send_json({'type': 'connect', 'compress': {'threshold': 10}})
+        assert websocket.receive_json() == {
+            'type': 'connect',
+            'batch': None,
+            'compress': {'threshold': 100},
+        }
+        websocket.send_json({'type': 'send', 'topic': 'tests/1'})
+        assert websocket.receive_json() == {'msg': 'x'}
+        frame = websocket.receive_bytes()
+        assert len(frame) < 100
+        assert json.loads(zlib.decompress(frame)) == {'msg': 'x' * 1000}
+        websocket.close()
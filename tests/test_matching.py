@@ -1,6 +1,26 @@
+import itertools
+
 import pytest
 
-from distributed_websocket._matching import matches
+from distributed_websocket._matching import (
+    Pattern,
+    PatternTrie,
+    compile_pattern,
+    matches,
+)
+
+
+def _reference_match(topic: str, pattern: str) -> bool:
+    # the original recursive matcher, kept as the reference behavior
+    return (
+        topic == pattern
+        or '#' == pattern[:1]
+        or pattern[:1] in (topic[:1], '+')
+        and _reference_match(
+            topic[1:],
+            pattern['+' != pattern[:1] or (topic[:1] in '/') * 2:]  # fmt: skip
+        )
+    )
 
 
 def test_matches_01():
@@ -59,3 +79,75 @@ def test_matches_03():
     assert not matches('root/sub1/sub2/sub2', {'root/sub2/sub2', 'root/+/sub2'})
     assert not matches('root/sub1/sub2/sub2', {'root/sub2/sub2', 'root/sub2/+/sub2'})
     assert not matches('root/sub1/sub2/sub2', {'root/sub2/sub2', '+/sub2/sub2'})
+
+
+def _patterns_and_topics():
+    segments = ('a', 'b', '', '+', '#')
+    for size in (1, 2, 3):
+        yield from ('/'.join(p) for p in itertools.product(segments, repeat=size))
+
+
+def test_pattern_trie_01():
+    trie = PatternTrie()
+    for pattern in ('root/sub1/sub2', 'root/+/sub2', 'root/#', 'root/+'):
+        trie.add(pattern)
+    assert len(trie) == 4
+    assert trie.match('root/sub1/sub2') == {
+        'root/sub1/sub2',
+        'root/+/sub2',
+        'root/#',
+    }
+    assert trie.match('root/sub1') == {'root/#', 'root/+'}
+    assert trie.match('other/sub1') == set()
+    trie.discard('root/#')
+    assert 'root/#' not in trie
+    assert trie.match('root/sub1') == {'root/+'}
+
+
+def test_pattern_trie_02():
+    patterns = set(_patterns_and_topics()) | {'a+', 'a/b#', '+a/b'}
+    trie = PatternTrie()
+    for pattern in patterns:
+        trie.add(pattern)
+    for topic in _patterns_and_topics():
+        assert trie.match(topic) == {
+            pattern for pattern in patterns if _reference_match(topic, pattern)
+        }
+    for pattern in patterns:
+        trie.discard(pattern)
+    assert len(trie) == 0
+    assert not trie._root.children
+
+
+def test_compiled_pattern_01():
+    patterns = set(_patterns_and_topics()) | {'a+', 'a/b#', '+a/b', 'a/++'}
+    for pattern in patterns:
+        compiled = compile_pattern(pattern)
+        assert compiled is compile_pattern(pattern)
+        for topic in _patterns_and_topics():
+            assert compiled.match(topic) == _reference_match(topic, pattern)
+            assert matches(topic, {pattern}) == _reference_match(topic, pattern)
+
+
+def test_compiled_pattern_02():
+    topic = '/'.join(['segment'] * 2000)
+    assert Pattern('/'.join(['+'] * 2000)).match(topic)
+    assert Pattern('segment/#').match(topic)
+    assert Pattern(topic[:-1] + '+').match(topic)
+    assert not Pattern(topic + '/x').match(topic)
+
+
+def test_pattern_trie_cache():
+    trie = PatternTrie(cache_size=2)
+    trie.add('root/+')
+    assert trie.match('root/1') == {'root/+'}
+    assert trie.match('root/2') == {'root/+'}
+    assert trie.match('root/3') == {'root/+'}
+    assert list(trie._cache) == ['root/2', 'root/3']
+    trie.add('root/#')
+    trie.add('other/#')
+    assert trie._cache['root/2'] == {'root/+', 'root/#'}
+    trie.discard('root/+')
+    assert trie._cache['root/3'] == {'root/#'}
+    assert trie.match('root/3') == {'root/#'}
+    assert list(trie._cache) == ['root/2', 'root/3']
@@ -0,0 +1,119 @@
+import asyncio
+import pathlib
+import sys
+import textwrap
+
+import pytest
+
+from distributed_websocket._broker import create_broker
+from distributed_websocket.utils import is_valid_broker
+
+
+def _message(i: int) -> dict:
+    return {'type': 'broadcast', 'topic': None, 'conn_id': None, 'i': i}
+
+
+async def _wait_for(condition, timeout: float = 5) -> None:
+    for _ in range(int(timeout * 100)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert condition()
+
+
+@pytest.mark.asyncio
+async def test_mesh_broker() -> None:
+    seed = create_broker('mesh://127.0.0.1:0')
+    assert is_valid_broker(seed)
+    await seed.connect()
+    node1 = create_broker(f'mesh://127.0.0.1:0?seed={seed.advertise}')
+    node2 = create_broker('mesh://127.0.0.1:0', seed=seed.advertise)
+    await node1.connect()
+    await node2.connect()
+    nodes = (seed, node1, node2)
+    # joining through the seed is enough to get a full mesh
+    await _wait_for(lambda: all(len(node.peers) == 2 for node in nodes))
+    await node1.subscribe('test')
+    await node2.psubscribe('te*')
+    await _wait_for(
+        lambda: node1.advertise in seed._remote
+        and 'test' in seed._remote[node1.advertise].channels
+        and 'te*' in seed._remote[node2.advertise].patterns
+        and 'te*' in node1._remote[node2.advertise].patterns
+    )
+    await seed.publish('test', _message(1))
+    await seed.publish('other', _message(2))
+    # the publisher receives its own messages too, when subscribed
+    await node1.publish('test', _message(3))
+    for node in (node1, node2):
+        received = [
+            await asyncio.wait_for(node.get_message(), 1) for _ in range(2)
+        ]
+        assert sorted(m.data['i'] for m in received) == [1, 3]
+    assert seed._messages.empty()
+    for node in nodes:
+        await node.disconnect()
+
+
+_NODE = textwrap.dedent(
+    '''
+    import asyncio
+    import sys
+
+    from distributed_websocket._broker import create_broker
+
+    async def main():
+        broker = create_broker(f'mesh://127.0.0.1:0?seed={sys.argv[1]}')
+        await broker.connect()
+        await broker.subscribe('test')
+        print('ready', flush=True)
+        message = await asyncio.wait_for(broker.get_message(), 10)
+        await broker.publish('reply', {**message.data, 'type': 'broadcast',
+                                       'topic': None, 'conn_id': None})
+        await asyncio.sleep(0.5)
+        await broker.disconnect()
+
+    asyncio.run(main())
+    '''
+)
+
+
+@pytest.mark.asyncio
+async def test_mesh_broker_processes() -> None:
+    seed = create_broker('mesh://127.0.0.1:0')
+    await seed.connect()
+    await seed.subscribe('reply')
+    # not blocking the event loop, that the seed needs to accept them
+    processes = [
+        await asyncio.create_subprocess_exec(
+            sys.executable,
+            '-c',
+            _NODE,
+            seed.advertise,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=pathlib.Path(__file__).parents[1],
+        )
+        for _ in range(2)
+    ]
+    try:
+        for process in processes:
+            line = await asyncio.wait_for(process.stdout.readline(), 10)
+            assert line.strip() == b'ready'
+        # messages only go out once the seed has connected back
+        await _wait_for(
+            lambda: len(seed.peers) == 2
+            and len(seed._remote) == 2
+            and all('test' in s.channels for s in seed._remote.values())
+        )
+        await seed.publish('test', _message(1))
+        for _ in processes:
+            message = await asyncio.wait_for(seed.get_message(), 5)
+            assert message.data == {'i': 1}
+    finally:
+        for process in processes:
+            try:
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        await seed.disconnect()
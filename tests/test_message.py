@@ -1,6 +1,11 @@
 import pytest
 
-from distributed_websocket._message import Message, untag_broker_message
+from distributed_websocket._envelope import pack_envelope
+from distributed_websocket._message import (
+    Message,
+    untag_broker_message,
+    validate_incoming_batch,
+)
 
 
 def test_message_01():
@@ -18,6 +23,8 @@ def test_message_01():
         'topic': 'test',
         'conn_id': 'test',
     }
+    assert m.data == {'msg': 'hello'}
+    assert not hasattr(m, '__dict__')
 
 
 def test_message_02():
@@ -30,6 +37,35 @@ def test_message_02():
     assert m.conn_id == 'test'
 
 
+def test_message_data_must_be_a_dict():
+    with pytest.raises(TypeError):
+        Message(data=['hello'], typ='send', topic='test')
+    # a binary envelope with a list payload
+    with pytest.raises(TypeError):
+        Message.from_broker_message(
+            pack_envelope(
+                {'type': 'send', 'topic': 'test', 'conn_id': None}, 'binary'
+            )[:-2]
+            + b'[]'
+        )
+
+
+def test_message_origin():
+    m = Message.from_client_message(
+        data={'type': 'broadcast', '__node_id__': 'node2', 'msg': 'hello'}
+    )
+    assert m.origin is None
+    assert m.data == {'msg': 'hello'}
+    m.origin = 'node1'
+    assert m.__serialize__()['__node_id__'] == 'node1'
+    m = Message.from_broker_message(
+        '{"msg": "hello", "type": "send", "topic": "test",'
+        ' "conn_id": null, "__node_id__": "node1"}'
+    )
+    assert m.origin == 'node1'
+    assert m.data == {'msg': 'hello'}
+
+
 def test_untag_broker_message_01():
     typ, topic, conn_id, data = untag_broker_message(
         '{"msg": "hello", "type": "send", "topic": "test", "conn_id": "test"}'
@@ -38,3 +74,16 @@ def test_untag_broker_message_01():
     assert topic == 'test'
     assert conn_id == 'test'
     assert data == {'msg': 'hello'}
+
+
+def test_validate_incoming_batch():
+    validate_incoming_batch(
+        [
+            {'type': 'subscribe', 'topic': 'a/b'},
+            {'type': 'send', 'topic': 'a/b', 'msg': 'hello'},
+        ]
+    )
+    with pytest.raises(ValueError, match='index 1'):
+        validate_incoming_batch([{'type': 'broadcast'}, {'type': 'send'}])
+    with pytest.raises(ValueError, match='index 0'):
+        validate_incoming_batch([1])
@@ -0,0 +1,69 @@
+import pytest
+
+from distributed_websocket._outbox import Outbox
+
+
+def test_outbox_drop_newest():
+    outbox = Outbox(2)
+    assert outbox.put('a') is None
+    assert outbox.put('b') is None
+    assert outbox.put('c') == 'drop_newest'
+    assert len(outbox) == 2
+    assert [entry[1] for entry in outbox._entries] == ['a', 'b']
+
+
+def test_outbox_drop_oldest():
+    outbox = Outbox(10, max_bytes=6, policy='drop_oldest')
+    assert outbox.put('aa') is None
+    assert outbox.put('bb') is None
+    assert outbox.put('cc') is None
+    assert outbox.put('ddd') == 'drop_oldest'
+    assert [entry[1] for entry in outbox._entries] == ['cc', 'ddd']
+    assert outbox.nbytes == 5
+    assert outbox.put('x' * 10) == 'drop_oldest'
+    assert [entry[1] for entry in outbox._entries] == ['x' * 10]
+
+
+def test_outbox_conflate():
+    outbox = Outbox(2, policy='conflate')
+    assert outbox.put('a1', 'a') is None
+    assert outbox.put('b1', 'b') is None
+    assert outbox.put('a2', 'a') == 'conflate'
+    assert [entry[1] for entry in outbox._entries] == ['a2', 'b1']
+    assert outbox.put('c1', 'c') == 'conflate'
+    assert [entry[1] for entry in outbox._entries] == ['b1', 'c1']
+    assert 'a' not in outbox._keys
+
+
+def test_outbox_conflate_always():
+    outbox = Outbox(10, max_bytes=6)
+    assert outbox.put('a1', 'a', conflate=True) is None
+    assert outbox.put('b1', 'b') is None
+    assert outbox.put('a2', 'a', conflate=True) is None
+    assert outbox.put('b2', 'b') is None
+    assert [entry[1] for entry in outbox._entries] == ['a2', 'b1', 'b2']
+    assert outbox.conflated == 1
+    assert outbox.nbytes == 6
+    # a replacement that does not fit goes through the policy
+    assert outbox.put('a333', 'a', conflate=True) == 'drop_newest'
+    assert outbox.conflated == 1
+
+
+def test_outbox_close():
+    outbox = Outbox(1, policy='close')
+    assert outbox.put('a') is None
+    assert outbox.put('b') == 'close'
+    assert len(outbox) == 1
+
+
+def test_outbox_invalid_policy():
+    with pytest.raises(ValueError):
+        Outbox(1, policy='block')
+
+
+@pytest.mark.asyncio
+async def test_outbox_get():
+    outbox = Outbox(2)
+    outbox.put('a')
+    assert await outbox.get() == 'a'
+    assert len(outbox) == outbox.nbytes == 0
@@ -0,0 +1,58 @@
+import pytest
+
+from distributed_websocket._matching import matches
+from distributed_websocket._routing import TopicRouter
+
+
+def test_topic_router_channel() -> None:
+    router = TopicRouter('test')
+    assert router.channel('a/b/c') == 'test:a/b/c'
+    router = TopicRouter('test', depth=2)
+    assert router.channel('a/b/c') == 'test:a/b'
+    assert router.channel('a') == 'test:a'
+    with pytest.raises(ValueError):
+        TopicRouter('test', depth=0)
+
+
+def test_topic_router_subscriptions() -> None:
+    router = TopicRouter('test', depth=2)
+    router.add('a/b/c')
+    router.add('a/b/+')
+    router.add('x/y')
+    assert router.channels == {'test:a/b', 'test:x/y'}
+    assert router.globs == set()
+    router.add('x/+')
+    router.add('x/+/z')
+    router.add('[/#')
+    # the glob covers the channel and the longer glob
+    assert router.channels == {'test:a/b'}
+    assert router.globs == {'test:x/*', 'test:\\[/*'}
+    router.discard('x/+')
+    assert router.globs == {'test:x/*', 'test:\\[/*'}
+    router.discard('x/+/z')
+    router.discard('[/#')
+    router.discard('a/b/c')
+    assert router.channels == {'test:a/b', 'test:x/y'}
+    assert router.globs == set()
+    router.discard('a/b/+')
+    router.discard('x/y')
+    assert router.channels == router.globs == set()
+
+
+@pytest.mark.parametrize('depth', [None, 1, 2, 3])
+def test_topic_router_coverage(depth: int | None) -> None:
+    # a topic matching a pattern is always published to a channel
+    # that the pattern subscribes to
+    patterns = ('a/b', 'a/+', 'a/#', '+/b', 'a/b+/c', 'a/b/+/d', '#')
+    topics = ('a/b', 'a/c', 'a/b/c', 'a/bx/c', 'a/b/c/d', 'x/b', 'a/')
+    router = TopicRouter('test', depth)
+    for pattern in patterns:
+        router.add(pattern)
+        for topic in topics:
+            if matches(topic, {pattern}):
+                channel = router.channel(topic)
+                assert channel in router.channels or any(
+                    channel.startswith(glob[:-1].replace('\\', ''))
+                    for glob in router.globs
+                ), (pattern, topic)
+        router.discard(pattern)
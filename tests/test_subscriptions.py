@@ -8,6 +8,7 @@ from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
 
 from distributed_websocket._connection import Connection
 from distributed_websocket._subscriptions import (
+    SubscriptionIndex,
     subscribe,
     unsubscribe,
     handle_subscription_message,
@@ -152,3 +153,35 @@ def test_subscriptions_06(
         websocket.send_json(
             {'type': 'unsubscribe', 'topic': 'test/1', 'conn_id': 'test'}
         )
+
+
+def test_subscription_index_01(
+    test_client_factory: Callable[[Callable[[Scope, Receive, Send], None]], TestClient]
+):
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        websocket = WebSocket(scope, receive=receive, send=send)
+        await websocket.accept()
+        index = SubscriptionIndex()
+        connection = Connection(websocket, 'test', 'test/1')
+        index.add_connection(connection)
+        assert index.match('test/1') == {connection}
+        async for data in connection.iter_json():
+            if is_subscription_message(m := Message.from_client_message(data=data)):
+                handle_subscription_message(connection, m)
+        assert connection.topics == {'test/+'}
+        assert index.match('test/1') == index.match('test/2') == {connection}
+        connection.topics.discard('test/+')
+        assert index.match('test/2') == set()
+        connection.topics |= {'test/#'}
+        assert index.match('test/3/4') == {connection}
+        index.remove_connection(connection)
+        assert index.match('test/3/4') == set()
+        assert len(index) == 0
+
+    client = test_client_factory(app)
+    with client.websocket_connect('/') as websocket:
+        websocket.send_json({'type': 'subscribe', 'topic': 'test/+', 'conn_id': 'test'})
+        websocket.send_json(
+            {'type': 'unsubscribe', 'topic': 'test/1', 'conn_id': 'test'}
+        )
+        websocket.close()